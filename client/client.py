@@ -1,15 +1,32 @@
 import sys
 import os
 import base64
+import binascii
+import logging
 import mimetypes
+import stat
 import tempfile
 import threading
+import unicodedata
 import uuid
-import time
+from collections import Counter, deque
+from functools import lru_cache, partial
+from itertools import chain
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
+from urllib.parse import unquote
 import socketio
-from PySide6.QtCore import QObject, Signal, Slot, QUrl, Property
+from PySide6.QtCore import (
+    QObject,
+    QRunnable,
+    QThreadPool,
+    QTimer,
+    Qt,
+    Signal,
+    Slot,
+    QUrl,
+    Property,
+)
 from PySide6.QtGui import QGuiApplication
 from PySide6.QtQml import QQmlApplicationEngine
 
@@ -17,18 +34,150 @@ try:
     from .crypto_utils import (
         generate_aes_key,
         rsa_encrypt_with_server_public_key,
+        forget_server_public_key,
         aes_encrypt,
+        aes_encrypt_chunks,
+        AES_ALGORITHM,
     )
 except ImportError:
     from crypto_utils import (
         generate_aes_key,
         rsa_encrypt_with_server_public_key,
+        forget_server_public_key,
         aes_encrypt,
+        aes_encrypt_chunks,
+        AES_ALGORITHM,
     )
 
+try:
+    import orjson  # optional: faster Socket.IO packet (de)serialisation
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
 
 MAX_FILE_BYTES = 5 * 1024 * 1024  # 5 MB safety cap
 MAX_AVATAR_BYTES = 128 * 1024  # 128 KB cap per avatar
+# Chunk sizes for streaming base64; multiples of 3 (encode) and 4 (decode)
+# keep every chunk self-contained so no carry-over state is needed.
+B64_ENCODE_CHUNK = 3 * 64 * 1024
+B64_DECODE_CHUNK = 4 * 64 * 1024
+FILE_CHUNK_BYTES = 64 * 1024  # ciphertext carried per file_chunk event
+OUTBOUND_FLUSH_MS = 50  # coalescing window for typing/read-receipt events
+
+# Connection states for ChatClient._conn_state
+CONN_IDLE = 0
+CONN_CONNECTING = 1
+CONN_UP = 2
+MAX_PENDING_EVENTS = 1024  # events buffered while offline; oldest dropped first
+
+# Automatic reconnection, handled by python-socketio after a dropped link
+MAX_RECONNECT_ATTEMPTS = 10
+RECONNECT_DELAY = 1  # seconds, doubled after each failed attempt
+RECONNECT_DELAY_MAX = 30
+
+
+# Not inherited by child processes; binary on Windows
+_WRITE_FLAGS = os.O_WRONLY | getattr(os, "O_CLOEXEC", 0) | getattr(os, "O_BINARY", 0)
+_NEW_FILE_FLAGS = _WRITE_FLAGS | os.O_CREAT | os.O_EXCL
+_OVERWRITE_FILE_FLAGS = _WRITE_FLAGS | os.O_CREAT | os.O_TRUNC
+
+
+def _write_all(fd: int, data) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+_thread_buffers = threading.local()
+
+
+def _read_buffer() -> memoryview:
+    """Per-thread scratch buffer for streaming reads; reused across files."""
+    view = getattr(_thread_buffers, "read_view", None)
+    if view is None:
+        view = _thread_buffers.read_view = memoryview(bytearray(B64_ENCODE_CHUNK))
+    return view
+
+
+class _OrjsonCodec:
+    """``json``-module stand-in handed to python-socketio when orjson exists."""
+
+    @staticmethod
+    def dumps(obj, **_kwargs):
+        # socketio passes stdlib-only kwargs (separators); orjson is compact
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    @staticmethod
+    def loads(data, **_kwargs):
+        return orjson.loads(data)
+
+
+# Load the platform MIME database at import rather than on the first
+# attachment, and answer the common extensions with a plain dict lookup
+mimetypes.init()
+_FAST_MIME = {
+    ext: mimetypes.types_map[ext]
+    for ext in (
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".webp",
+        ".pdf",
+        ".txt",
+        ".mp3",
+        ".mp4",
+        ".zip",
+    )
+    if ext in mimetypes.types_map
+}
+
+
+def _guess_mime(name: str) -> str:
+    fast = _FAST_MIME.get(os.path.splitext(name)[1].lower())
+    return fast or _guess_mime_slow(name)
+
+
+@lru_cache(maxsize=256)
+def _guess_mime_slow(name: str) -> str:
+    mime, _ = mimetypes.guess_type(name)
+    return mime or "application/octet-stream"
+
+
+def _name_key(username: str) -> str:
+    # Same key as the server's uniqueness check: NFKC, then casefold
+    return unicodedata.normalize("NFKC", username).casefold()
+
+
+class _FileJobSignals(QObject):
+    filePrepared = Signal(str, object)  # job_id, result (None if rejected)
+    fileFailed = Signal(str, str)  # job_id, error message
+
+
+class _FileJob(QRunnable):
+    """Run a blocking file operation on the global thread pool.
+
+    Results are reported through ``signals`` so the caller can pick them up
+    on the Qt thread via a queued connection.
+    """
+
+    def __init__(self, job_id: str, func, *args):
+        super().__init__()
+        self.job_id = job_id
+        self.signals = _FileJobSignals()
+        self._func = func
+        self._args = args
+
+    def run(self):
+        try:
+            result = self._func(*self._args)
+        except Exception as exc:
+            self.signals.fileFailed.emit(self.job_id, str(exc))
+            return
+        self.signals.filePrepared.emit(self.job_id, result)
 
 
 class ChatClient(QObject):
@@ -70,6 +219,11 @@ class ChatClient(QObject):
     avatarsUpdated = Signal("QVariant")  # username -> avatar payload
     avatarUpdated = Signal(str, "QVariant")  # username, avatar payload
     connectionStateChanged = Signal(str)  # "connected", "reconnecting", "offline"
+    fileInspected = Signal(str, "QVariant")  # job_id, file info ({} if rejected)
+    historyFileSaved = Signal(str, str)  # filename, saved file URL ("" on failure)
+    # Internal: hop user/avatar state from the socketio thread to the Qt thread
+    _userListReceived = Signal("QVariant")
+    _avatarUpdateReceived = Signal("QVariant")
 
     def __init__(self, url=None):
         super().__init__()
@@ -89,447 +243,544 @@ class ChatClient(QObject):
         self._url = resolved_url
         self._username = ""
         self._desired_username = ""
-        self._sio = socketio.Client()
-        self._connected = False
-        self._connecting = False
+        self._sio = socketio.Client(
+            reconnection=True,
+            reconnection_attempts=MAX_RECONNECT_ATTEMPTS,
+            reconnection_delay=RECONNECT_DELAY,
+            reconnection_delay_max=RECONNECT_DELAY_MAX,
+            json=_OrjsonCodec if orjson is not None else None,
+        )
+        # Written only under _connect_lock; read lock-free on the emit path
+        self._conn_state = CONN_IDLE
         self._users = []
         self._avatars = {}
         self._connect_lock = threading.Lock()
         self._pending_lock = threading.Lock()
-        self._pending_events = []
+        self._pending_events = deque(maxlen=MAX_PENDING_EVENTS)
+        self._pending_types = Counter()  # event name -> count in _pending_events
         self._history_synced = False
         self._public_typing_flag = False
         self._private_typing_flags = {}
+        # Outbound typing/read-receipt events coalesced until the timer fires
+        self._pending_typing: Dict[Tuple[str, Optional[str]], bool] = {}
+        self._pending_reads: Dict[str, set] = {}
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(OUTBOUND_FLUSH_MS)
+        self._flush_timer.timeout.connect(self._flush_pending)
+        # AutoConnection: queued when emitted from socketio's thread, direct
+        # when already on the Qt thread
+        self._userListReceived.connect(self._apply_user_list)
+        self._avatarUpdateReceived.connect(self._apply_avatar_update)
 
         # Session AES key (exchanged with server via RSA)
         self._session_aes_key: Optional[bytes] = None
         self._session_ready: bool = False
+        self._session_key_retried = False  # one refetch per connect on rejection
         self._post_key_queue = []  # events queued until session key ack
         self._active_transfers = {}  # transfer_id -> transfer_data
-        self._received_chunks = {}  # transfer_id -> {chunk_index: data}
-        self._transfer_lock = threading.Lock()
-        self._active_transfers = {}  # transfer_id -> transfer_data
-        self._received_chunks = {}  # transfer_id -> {chunk_index: data}
+        # transfer_id -> {"buf": bytearray | None, "seen": set, "early": dict}
+        self._received_chunks = {}
         self._transfer_lock = threading.Lock()
         self._download_threads = {}  # transfer_id -> thread
+        self._file_jobs = {}  # job_id -> (continuation, job signals)
+        # History attachments fetched on demand: file_id -> (filename, mime)
+        self._requested_files: Dict[str, Tuple[str, str]] = {}
         # self._completed_transfers = set()
-        self._debug_enabled = True
 
-        # Reconnection logic
+        # Reconnection is driven by socketio's own task; these only feed the UI
+        self._reconnecting = False
         self._reconnect_attempts = 0
-        self._max_reconnect_attempts = 10
-        self._reconnect_delay = 1.0  # Start with 1 second
-        self._max_reconnect_delay = 30.0  # Max 30 seconds between attempts
-        self._should_reconnect = True
-        self._reconnect_thread = None
         self._user_requested_disconnect = False
         self._connection_state = "offline"  # Track connection state
 
         self._setup_handlers()
 
     def _dbg(self, *args):
-        try:
-            if self._debug_enabled:
-                print("[CLIENT]", *args)
-        except Exception as e:
-            print(f"[CLIENT] Debug logging error: {e}")
+        # Called per file chunk; skip all formatting unless DEBUG is enabled
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(" ".join(str(arg) for arg in args))
+
+    # Inbound payload schemas: (key, default[, kind]) per signal argument
+    _PRIVATE_MESSAGE_SCHEMA = (
+        ("sender", "Unknown"),
+        ("recipient", "Unknown"),
+        ("message", ""),
+        ("message_id", 0, int),
+        ("status", ""),
+        ("file", {}, dict),
+        ("timestamp", ""),
+    )
+    # Server errors mentioning any of these concern the chosen username
+    # ("name" already covers "username")
+    _USERNAME_ERR_TOKENS = ("name",)
+    _TYPING_SCHEMA = (("username", None), ("is_typing", False, bool))
+    _EVENT_SCHEMAS = {
+        "message": (
+            ("username", "Unknown"),
+            ("message", ""),
+            ("file", {}, dict),
+            ("timestamp", ""),
+        ),
+        "private_message_received": _PRIVATE_MESSAGE_SCHEMA,
+        "private_message_sent": _PRIVATE_MESSAGE_SCHEMA,
+        "public_typing": _TYPING_SCHEMA,
+        "private_typing": _TYPING_SCHEMA,
+    }
+
+    @staticmethod
+    def _coerce_field(value, default, kind=None):
+        if kind is None:
+            return value
+        if kind is dict:
+            return value if isinstance(value, dict) else {}
+        if kind is int:
+            # JSON already yields ints; only strings/None need converting
+            if type(value) is int:
+                return value
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return default
+        return kind(value)
+
+    @classmethod
+    def _coerce(cls, data: dict, schema) -> tuple:
+        return tuple(
+            cls._coerce_field(data.get(key, default), default, *kind)
+            for key, default, *kind in schema
+        )
 
     def _setup_handlers(self):
-        @self._sio.event
-        def connect():
-            print("Connected")
-            self._connected = True
-            self._connecting = False
-            self._set_connection_state("connected")
-
-            # Reset reconnection state on successful connection
-            was_reconnecting = self._reconnect_attempts > 0
-            self._reconnect_attempts = 0
-            self._reconnect_delay = 1.0
-
-            # Establish session AES key with server
+        for event, handler in (
+            ("connect", self._on_connect),
+            ("session_key_ok", self._on_session_key_ok),
+            ("disconnect", self._on_disconnect),
+            ("connect_error", self._on_connect_error),
+            ("__disconnect_final", self._on_disconnect_final),
+            ("message", self._on_message),
+            ("private_message_received", self._on_private_message),
+            ("private_message_sent", self._on_private_message_sent),
+            ("private_message_read", self._on_private_message_read),
+            ("private_message_read_batch", self._on_private_message_read_batch),
+            ("public_typing", self._on_public_typing),
+            ("private_typing", self._on_private_typing),
+            ("update_user_list", self._on_update_user_list),
+            ("avatar_update", self._on_avatar_update),
+            ("chat_history", self._on_chat_history),
+            ("error", self._on_error),
+            ("file_chunk", self._on_file_chunk),
+            ("file_transfer_ack", self._on_file_transfer_ack),
+            ("history_file", self._on_history_file),
+        ):
+            self._sio.on(event)(handler)
+
+    def _on_connect(self):
+        print("Connected")
+        self._set_connection_state("connected")
+
+        # Reset reconnection state on successful connection
+        was_reconnecting = self._reconnecting
+        self._reconnecting = False
+        self._reconnect_attempts = 0
+
+        self._session_key_retried = False
+        self._exchange_session_key()
+        queued_register = False
+        with self._pending_lock:
+            # Flip to CONN_UP while holding the queue lock so no event can be
+            # appended after the drain below
+            with self._connect_lock:
+                self._conn_state = CONN_UP
+            queued_register = self._pending_types["register"] > 0
+            pending = self._pending_events
+            self._pending_events = deque(maxlen=MAX_PENDING_EVENTS)
+            self._pending_types.clear()
+        # Not appendleft: on a full bounded deque that would evict the newest
+        head = []
+        if self._desired_username and not queued_register:
+            head.append(("register", {"username": self._desired_username}))
+        for event, payload in chain(head, pending):
             try:
-                self._session_aes_key = generate_aes_key()
-                # Pass server URL so it can fetch public key dynamically
-                encrypted = rsa_encrypt_with_server_public_key(
-                    self._session_aes_key, self._url
-                )
-                self._sio.emit("session_key", {"encrypted_aes_key": encrypted})
-            except Exception as e:
-                print(f"[CLIENT] Failed to exchange session key: {e}")
-                self._notify_error(
-                    "Unable to establish secure connection. Please check your network."
-                )
-            queued_register = False
-            with self._pending_lock:
-                queued_register = any(
-                    evt == "register" for evt, _ in self._pending_events
-                )
-                pending = list(self._pending_events)
-                self._pending_events.clear()
-            if self._desired_username and not queued_register:
-                pending.insert(0, ("register", {"username": self._desired_username}))
-            for event, payload in pending:
-                try:
-                    self._sio.emit(event, payload)
-                except Exception as exc:
-                    print(f"[CLIENT] Failed to send '{event}': {exc}")
-                    self._notify_error(
-                        "Unable to send data. Please check your connection."
-                    )
+                self._sio.emit(event, payload)
+            except Exception as exc:
+                print(f"[CLIENT] Failed to send '{event}': {exc}")
+                self._notify_error("Unable to send data. Please check your connection.")
 
-            # Notify UI of successful reconnection
-            if was_reconnecting:
-                print("[CLIENT] Successfully reconnected")
-                self.reconnected.emit()
+        # Notify UI of successful reconnection
+        if was_reconnecting:
+            print("[CLIENT] Successfully reconnected")
+            self.reconnected.emit()
 
-        @self._sio.on("session_key_ok")
-        def on_session_key_ok(data):
-            self._session_ready = True
-            # Flush queued events that require session key
-            with self._pending_lock:
-                queued = list(self._post_key_queue)
-                self._post_key_queue.clear()
-            for event, payload in queued:
-                try:
-                    self._sio.emit(event, payload)
-                except Exception as exc:
-                    self._notify_error(f"Failed to send '{event}': {exc}")
-
-        @self._sio.event
-        def disconnect():
-            print("Logged out from server")
-            self._connected = False
-            self._connecting = False
-            self._set_connection_state("offline")
-            self._users = []
-            self._avatars = {}
-            self._pending_events.clear()
-            self._public_typing_flag = False
-            self._private_typing_flags.clear()
-            self.usersUpdated.emit([])
-            self.avatarsUpdated.emit({})
-            self._set_username("")
-            self.disconnected.emit(self._user_requested_disconnect)  # Notify the UI
-            self._history_synced = False
-
-            # Start automatic reconnection if not a user-requested disconnect
-            if self._should_reconnect and not self._user_requested_disconnect:
-                print("[CLIENT] Connection lost, will attempt to reconnect...")
-                self._start_reconnection()
-
-        @self._sio.on("message")
-        def on_message(data):
-            username = data.get("username", "Unknown")
-            message = data.get("message", "")
-            timestamp = data.get("timestamp", "")
-            file_payload = (
-                data.get("file") if isinstance(data.get("file"), dict) else {}
-            )
-            self.messageReceived.emit(username, message, file_payload)
-            self.messageReceivedEx.emit(username, message, file_payload, timestamp)
-
-        @self._sio.on("private_message_received")
-        def on_private_message(data):
-            sender = data.get("sender", "Unknown")
-            recipient = data.get("recipient", "Unknown")
-            message = data.get("message", "")
-            message_id = data.get("message_id")
-            status = data.get("status", "")
-            timestamp = data.get("timestamp", "")
-            try:
-                message_id = int(message_id)
-            except (TypeError, ValueError):
-                message_id = 0
-            file_payload = (
-                data.get("file") if isinstance(data.get("file"), dict) else {}
+    def _exchange_session_key(self):
+        # Establish session AES key with server
+        try:
+            self._session_aes_key = generate_aes_key()
+            # Pass server URL so it can fetch public key dynamically; the key
+            # is cached per URL after the first fetch
+            encrypted = rsa_encrypt_with_server_public_key(
+                self._session_aes_key, self._url
             )
-            self.privateMessageReceivedEx.emit(
-                sender, recipient, message, message_id, status, file_payload, timestamp
+            self._sio.emit("session_key", {"encrypted_aes_key": encrypted})
+        except Exception as e:
+            print(f"[CLIENT] Failed to exchange session key: {e}")
+            self._notify_error(
+                "Unable to establish secure connection. Please check your network."
             )
 
-        @self._sio.on("private_message_sent")
-        def on_private_message_sent(data):
-            sender = data.get("sender", "Unknown")
-            recipient = data.get("recipient", "Unknown")
-            message = data.get("message", "")
-            status = data.get("status", "")
-            message_id = data.get("message_id")
-            timestamp = data.get("timestamp", "")
+    def _on_session_key_ok(self, data):
+        self._session_ready = True
+        # Flush queued events that require session key
+        with self._pending_lock:
+            queued = list(self._post_key_queue)
+            self._post_key_queue.clear()
+        for event, payload in queued:
             try:
-                message_id = int(message_id)
-            except (TypeError, ValueError):
-                message_id = 0
-            file_payload = (
-                data.get("file") if isinstance(data.get("file"), dict) else {}
+                self._sio.emit(event, payload)
+            except Exception as exc:
+                self._notify_error(f"Failed to send '{event}': {exc}")
+
+    def _on_disconnect(self):
+        print("Logged out from server")
+        # socketio starts its reconnect task right after this handler unless
+        # the disconnect was ours; keep emits queued until it lands
+        will_reconnect = self._sio.reconnection and not self._user_requested_disconnect
+        with self._connect_lock:
+            self._conn_state = CONN_CONNECTING if will_reconnect else CONN_IDLE
+        self._set_connection_state("offline")
+        with self._pending_lock:
+            self._pending_events.clear()
+            self._pending_types.clear()
+        self._public_typing_flag = False
+        self._private_typing_flags.clear()
+        self._pending_typing = {}
+        self._userListReceived.emit({})
+        self.disconnected.emit(self._user_requested_disconnect)  # Notify the UI
+        self._history_synced = False
+
+        if will_reconnect:
+            print("[CLIENT] Connection lost, will attempt to reconnect...")
+            self._reconnecting = True
+            self._reconnect_attempts = 1
+            self._set_connection_state("reconnecting")
+            self.reconnecting.emit(self._reconnect_attempts)
+
+    def _on_connect_error(self, data=None):
+        # Raised for every failed handshake, including socketio's retries
+        if not self._reconnecting:
+            return
+        self._reconnect_attempts += 1
+        if self._reconnect_attempts <= MAX_RECONNECT_ATTEMPTS:
+            self.reconnecting.emit(self._reconnect_attempts)
+        else:
+            # Every retry has failed. Older python-socketio (e.g. the pinned
+            # 5.8.0) ends its reconnect loop without "__disconnect_final", so
+            # give up here as well; a later final event is then a no-op
+            self._on_disconnect_final()
+
+    def _on_disconnect_final(self):
+        # socketio gave up (or was never going to retry); allow a fresh connect
+        with self._connect_lock:
+            if self._conn_state != CONN_UP:
+                self._conn_state = CONN_IDLE
+        if not self._reconnecting:
+            return
+        self._reconnecting = False
+        self._set_connection_state("offline")
+        if not self._user_requested_disconnect:
+            print(
+                f"[CLIENT] Max reconnection attempts ({MAX_RECONNECT_ATTEMPTS}) reached. Giving up."
             )
-            self.privateMessageSentEx.emit(
-                sender, recipient, message, message_id, status, file_payload, timestamp
+            self._notify_error(
+                f"Failed to reconnect after {MAX_RECONNECT_ATTEMPTS} attempts."
             )
 
-        @self._sio.on("private_message_read")
-        def on_private_message_read(data):
-            message_id = data.get("message_id")
+    def _on_message(self, data):
+        username, message, file_payload, timestamp = self._coerce(
+            data, self._EVENT_SCHEMAS["message"]
+        )
+        self.messageReceived.emit(username, message, file_payload)
+        self.messageReceivedEx.emit(username, message, file_payload, timestamp)
+
+    def _on_private_message(self, data):
+        self.privateMessageReceivedEx.emit(
+            *self._coerce(data, self._EVENT_SCHEMAS["private_message_received"])
+        )
+
+    def _on_private_message_sent(self, data):
+        self.privateMessageSentEx.emit(
+            *self._coerce(data, self._EVENT_SCHEMAS["private_message_sent"])
+        )
+
+    def _on_private_message_read(self, data):
+        message_id = data.get("message_id")
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return
+        self.privateMessageRead.emit(message_id)
+
+    def _on_private_message_read_batch(self, data):
+        message_ids = data.get("message_ids")
+        if not isinstance(message_ids, list):
+            return
+        for message_id in message_ids:
             try:
                 message_id = int(message_id)
             except (TypeError, ValueError):
-                return
+                continue
             self.privateMessageRead.emit(message_id)
 
-        @self._sio.on("public_typing")
-        def on_public_typing(data):
-            username = data.get("username")
-            is_typing = bool(data.get("is_typing"))
-            if username:
-                self.publicTypingReceived.emit(username, is_typing)
-
-        @self._sio.on("private_typing")
-        def on_private_typing(data):
-            username = data.get("username")
-            is_typing = bool(data.get("is_typing"))
-            if username:
-                self.privateTypingReceived.emit(username, is_typing)
-
-        # Replaced user_joined with update_user_list to sync with server
-        @self._sio.on("update_user_list")
-        def on_update_user_list(data):
-            users = data.get("users", [])
-            self._users = users
-            avatars = data.get("avatars", {})
-            if isinstance(avatars, dict):
-                snapshot: Dict[str, Dict[str, Any]] = {}
-                for name, info in avatars.items():
-                    if isinstance(info, dict) and info.get("data"):
-                        snapshot[name] = info
-                self._avatars = snapshot
-                self.avatarsUpdated.emit(snapshot.copy())
-            else:
-                self._avatars = {}
-                self.avatarsUpdated.emit({})
-            if self._desired_username and self._desired_username in users:
-                self._set_username(self._desired_username)
-            elif self._username and self._username not in users:
-                self._set_username("")
-
-            # No per-user key exchange under server-managed encryption
-
-            self.usersUpdated.emit(self._users.copy())
-
-        @self._sio.on("avatar_update")
-        def on_avatar_update(data):
-            username = data.get("username")
-            avatar = data.get("avatar")
-            if not isinstance(username, str) or not username:
-                return
-            payload = avatar if isinstance(avatar, dict) else {}
-            if payload.get("data"):
-                self._avatars[username] = payload
-            else:
-                self._avatars.pop(username, None)
-            self.avatarUpdated.emit(username, payload)
-            self.avatarsUpdated.emit(self._avatars.copy())
-
-        @self._sio.on("chat_history")
-        def on_chat_history(data):
-            messages = data.get("messages", [])
-            self.generalHistoryReceived.emit(messages)
-
-        @self._sio.on("error")
-        def on_error(data):
-            message = data.get("message", "An unknown error occurred.")
-            self._notify_error(message)
-            lowered = message.lower()
-            is_username_error = "username" in lowered or "name" in lowered
-            if (
-                is_username_error
-                and self._desired_username
-                and self._desired_username == self._username
-            ):
-                # Preserve desired username for reconnection attempts but allow UI edits
-                self._set_username("")
-            if self._desired_username and is_username_error:
-                self._desired_username = ""
-
-        # No per-user public key exchange in the new scheme
-
-        @self._sio.on("file_chunk")
-        def on_file_chunk(data):
-            """Handle incoming file chunks."""
-            transfer_id = data.get("transfer_id")
-            chunk_index = data.get("chunk_index")
-            chunk_data = data.get("chunk_data")
-            is_last_chunk = data.get("is_last_chunk", False)
-            metadata = data.get("metadata")
-
-            if not all([transfer_id, chunk_index is not None, chunk_data]):
-                self._notify_error("Invalid file chunk received")
-                return
-
-            self._dbg(
-                "file_chunk received:",
-                "id=",
-                transfer_id,
-                "idx=",
-                chunk_index,
-                "last=",
-                is_last_chunk,
-                "meta?=",
-                bool(metadata),
-            )
-
-            should_reassemble = False
-            with self._transfer_lock:
-                # Initialize chunk storage
-                if transfer_id not in self._received_chunks:
-                    self._received_chunks[transfer_id] = {}
+    def _on_public_typing(self, data):
+        username, is_typing = self._coerce(data, self._EVENT_SCHEMAS["public_typing"])
+        if username:
+            self.publicTypingReceived.emit(username, is_typing)
+
+    def _on_private_typing(self, data):
+        username, is_typing = self._coerce(data, self._EVENT_SCHEMAS["private_typing"])
+        if username:
+            self.privateTypingReceived.emit(username, is_typing)
+
+    def _on_update_user_list(self, data):
+        self._userListReceived.emit(data)
+
+    def _on_avatar_update(self, data):
+        self._avatarUpdateReceived.emit(data)
+
+    @Slot("QVariant")
+    def _apply_user_list(self, data):
+        users = data.get("users", [])
+        # The server rebroadcasts the roster on every join/leave/avatar change;
+        # only push to QML what actually changed, since each emit rebuilds a view
+        users_changed = users != self._users
+        previous_name = self._username
+        self._users = users
+        avatars = data.get("avatars", {})
+        snapshot: Dict[str, Dict[str, Any]] = {}
+        if isinstance(avatars, dict):
+            for name, info in avatars.items():
+                if isinstance(info, dict) and info.get("data"):
+                    snapshot[name] = info
+        if snapshot != self._avatars:
+            self._avatars = snapshot
+            self.avatarsUpdated.emit(snapshot.copy())
+        if self._desired_username and self._desired_username in users:
+            self._set_username(self._desired_username)
+        elif self._username and self._username not in users:
+            self._set_username("")
 
-                # Store chunk data
-                try:
-                    self._received_chunks[transfer_id][chunk_index] = base64.b64decode(
-                        chunk_data
-                    )
-                except Exception as e:
-                    self._dbg(f"Failed to decode chunk {chunk_index}: {e}")
-                    return
+        # QML filters the local user out of the list, so a rename needs a refresh
+        if users_changed or self._username != previous_name:
+            # _users is replaced, never mutated in place, so no copy is needed
+            self.usersUpdated.emit(users)
 
-                # Store metadata from first chunk
-                if metadata and chunk_index == 0:
-                    self._active_transfers[transfer_id] = metadata
-                    self._dbg(
-                        f"Stored metadata for {transfer_id}: "
-                        f"total_chunks={metadata.get('total_chunks')}, "
-                        f"filename={metadata.get('filename')}"
-                    )
+    @Slot("QVariant")
+    def _apply_avatar_update(self, data):
+        username = data.get("username")
+        avatar = data.get("avatar")
+        if not isinstance(username, str) or not username:
+            return
+        payload = avatar if isinstance(avatar, dict) else {}
+        if payload.get("data"):
+            self._avatars[username] = payload
+        else:
+            self._avatars.pop(username, None)
+        self.avatarUpdated.emit(username, payload)
+        self.avatarsUpdated.emit(self._avatars.copy())
+
+    def _on_chat_history(self, data):
+        messages = data.get("messages", [])
+        self.generalHistoryReceived.emit(messages)
+
+    def _on_history_file(self, data):
+        file_id = data.get("file_id")
+        request = (
+            self._requested_files.pop(file_id, None)
+            if isinstance(file_id, str)
+            else None
+        )
+        if request is None:
+            return
+        filename, mime = request
+        body = data.get("data")
+        saved = self.saveFileToDownloads(
+            filename, body if isinstance(body, str) else "", mime
+        )
+        self.historyFileSaved.emit(filename, saved)
+
+    def _on_error(self, data):
+        message = data.get("message", "An unknown error occurred.")
+        if message == "Invalid session key." and not self._session_key_retried:
+            # The server's RSA key may have rotated since it was cached
+            self._session_key_retried = True
+            forget_server_public_key(self._url)
+            self._exchange_session_key()
+            return
+        self._notify_error(message)
+        lowered = message.casefold()
+        is_username_error = any(tok in lowered for tok in self._USERNAME_ERR_TOKENS)
+        if (
+            is_username_error
+            and self._desired_username
+            and self._desired_username == self._username
+        ):
+            # Preserve desired username for reconnection attempts but allow UI edits
+            self._set_username("")
+        if self._desired_username and is_username_error:
+            self._desired_username = ""
 
-                # Check if all chunks received
-                stored_meta = self._active_transfers.get(transfer_id, {})
-                expected_chunks = stored_meta.get("total_chunks", 0)
+    def _on_file_chunk(self, data):
+        """Handle incoming file chunks."""
+        transfer_id = data.get("transfer_id")
+        chunk_index = data.get("chunk_index")
+        chunk_data = data.get("chunk_data")
+        is_last_chunk = data.get("is_last_chunk", False)
+        metadata = data.get("metadata")
 
-                # Fallback if metadata missing
-                if expected_chunks == 0 and metadata:
-                    expected_chunks = metadata.get("total_chunks", 0)
+        if not all([transfer_id, chunk_index is not None, chunk_data]):
+            self._notify_error("Invalid file chunk received")
+            return
 
-                if expected_chunks == 0 and is_last_chunk:
-                    expected_chunks = chunk_index + 1
+        self._dbg(
+            "file_chunk received:",
+            "id=",
+            transfer_id,
+            "idx=",
+            chunk_index,
+            "last=",
+            is_last_chunk,
+            "meta?=",
+            bool(metadata),
+        )
 
-                received_count = len(self._received_chunks[transfer_id])
+        # Chunks arrive as socketio binary attachments; base64 strings only
+        # come from older servers. Decode before taking the lock.
+        try:
+            if isinstance(chunk_data, str):
+                chunk_data = base64.b64decode(chunk_data)
+        except Exception as e:
+            self._dbg(f"Failed to decode chunk {chunk_index}: {e}")
+            return
 
+        should_reassemble = False
+        with self._transfer_lock:
+            # Initialize chunk storage
+            entry = self._received_chunks.get(transfer_id)
+            if entry is None:
+                entry = {"buf": None, "seen": set(), "early": {}}
+                self._received_chunks[transfer_id] = entry
+
+            # Store metadata from first chunk
+            if metadata and chunk_index == 0:
+                self._active_transfers[transfer_id] = metadata
                 self._dbg(
-                    f"Progress for {transfer_id}: "
-                    f"received={received_count}, expected={expected_chunks}"
-                )
-
-                # Emit progress
-                self.fileTransferProgress.emit(
-                    transfer_id, received_count, expected_chunks
+                    f"Stored metadata for {transfer_id}: "
+                    f"total_chunks={metadata.get('total_chunks')}, "
+                    f"filename={metadata.get('filename')}"
                 )
+                self._allocate_transfer_buffer(entry, metadata)
 
-                # Check if ready to reassemble
-                if received_count >= expected_chunks and expected_chunks > 0:
-                    should_reassemble = True
-
-            # Start background reassembly
-            if should_reassemble:
-                self._dbg(f"Starting background reassembly for {transfer_id}")
-                thread = threading.Thread(
-                    target=self._reassemble_file_background,
-                    args=(transfer_id,),
-                    daemon=True,
-                )
-                with self._transfer_lock:
-                    self._download_threads[transfer_id] = thread
-                thread.start()
-
-            @self._sio.on("file_transfer_ack")
-            def on_file_transfer_ack(data):
-                """Handle file transfer acknowledgment."""
-                transfer_id = data.get("transfer_id")
-                success = data.get("success", False)
-                error_msg = data.get("error", "")
-
-                if success:
-                    self.fileTransferComplete.emit(transfer_id, "")
-                else:
-                    self.fileTransferError.emit(transfer_id, error_msg)
+            # Write straight into the file's final position when the size is
+            # known; anything else is held until reassembly
+            if not self._store_chunk(entry, chunk_index, chunk_data):
+                self._dbg("Chunk", chunk_index, "does not fit transfer", transfer_id)
+                return
 
-                # Clean up transfer data
-                with self._transfer_lock:
-                    self._active_transfers.pop(transfer_id, None)
-                    self._received_chunks.pop(transfer_id, None)
+            # Check if all chunks received
+            stored_meta = self._active_transfers.get(transfer_id, {})
+            expected_chunks = stored_meta.get("total_chunks", 0)
 
-        # Messages from server are plaintext after server-side decryption
+            # Fallback if metadata missing
+            if expected_chunks == 0 and metadata:
+                expected_chunks = metadata.get("total_chunks", 0)
 
-        # Private messages are also plaintext after server-side decryption
+            if expected_chunks == 0 and is_last_chunk:
+                expected_chunks = chunk_index + 1
 
-        # Sent confirmations are plaintext
+            received_count = len(entry["seen"])
 
-    def _start_reconnection(self):
-        """Start the reconnection loop in a background thread."""
-        if self._reconnect_thread and self._reconnect_thread.is_alive():
-            return  # Already trying to reconnect
+            # Check if ready to reassemble
+            if received_count >= expected_chunks and expected_chunks > 0:
+                should_reassemble = True
 
-        self._reconnect_thread = threading.Thread(
-            target=self._reconnection_loop, daemon=True
+        self._dbg(
+            "Progress for",
+            transfer_id,
+            "received=",
+            received_count,
+            "expected=",
+            expected_chunks,
         )
-        self._reconnect_thread.start()
 
-    def _reconnection_loop(self):
-        """Attempt to reconnect with exponential backoff."""
-        while self._should_reconnect and not self._connected:
-            self._reconnect_attempts += 1
+        # Emit progress outside the lock; connected slots may re-enter
+        self.fileTransferProgress.emit(transfer_id, received_count, expected_chunks)
 
-            if self._reconnect_attempts > self._max_reconnect_attempts:
-                print(
-                    f"[CLIENT] Max reconnection attempts ({self._max_reconnect_attempts}) reached. Giving up."
-                )
-                self._notify_error(
-                    f"Failed to reconnect after {self._max_reconnect_attempts} attempts."
-                )
-                break
-
-            print(
-                f"[CLIENT] Reconnection attempt {self._reconnect_attempts}/{self._max_reconnect_attempts}..."
+        # Start background reassembly
+        if should_reassemble:
+            self._dbg(f"Starting background reassembly for {transfer_id}")
+            thread = threading.Thread(
+                target=self._reassemble_file_background,
+                args=(transfer_id,),
+                daemon=True,
             )
-            self._set_connection_state("reconnecting")
-            self.reconnecting.emit(self._reconnect_attempts)
-
-            try:
-                with self._connect_lock:
-                    self._connecting = True
-
-                self._sio.connect(self._url)
-                # If we reach here, connection succeeded
-                print(
-                    f"[CLIENT] Reconnection successful on attempt {self._reconnect_attempts}"
-                )
-                return
-
-            except Exception as e:
-                print(
-                    f"[CLIENT] Reconnection attempt {self._reconnect_attempts} failed: {e}"
-                )
-                with self._connect_lock:
-                    self._connecting = False
+            with self._transfer_lock:
+                self._download_threads[transfer_id] = thread
+            thread.start()
 
-                # Exponential backoff with max cap
-                delay = min(
-                    self._reconnect_delay * (2 ** (self._reconnect_attempts - 1)),
-                    self._max_reconnect_delay,
-                )
-                print(f"[CLIENT] Waiting {delay:.1f} seconds before next attempt...")
-                time.sleep(delay)
+    @staticmethod
+    def _allocate_transfer_buffer(entry: dict, metadata: dict) -> None:
+        try:
+            total_size = int(metadata.get("total_size", 0))
+            chunk_size = int(metadata.get("chunk_size", 0))
+        except (TypeError, ValueError):
+            return
+        if not 0 < total_size <= MAX_FILE_BYTES or chunk_size <= 0:
+            return
+        entry["buf"] = bytearray(total_size)
+        entry["chunk_size"] = chunk_size
+        early, entry["early"] = entry["early"], {}
+        entry["seen"].clear()
+        for index, chunk in early.items():
+            ChatClient._store_chunk(entry, index, chunk)
+
+    @staticmethod
+    def _store_chunk(entry: dict, index: int, chunk) -> bool:
+        if not isinstance(index, int):
+            return False
+        buf = entry["buf"]
+        if buf is None:
+            entry["early"][index] = bytes(chunk)
+        else:
+            offset = index * entry["chunk_size"]
+            end = offset + len(chunk)
+            if index < 0 or end > len(buf):
+                return False
+            buf[offset:end] = chunk
+        entry["seen"].add(index)
+        return True
+
+    def _on_file_transfer_ack(self, data):
+        """Handle file transfer acknowledgment."""
+        transfer_id = data.get("transfer_id")
+        success = data.get("success", False)
+        error_msg = data.get("error", "")
+
+        if success:
+            self.fileTransferComplete.emit(transfer_id, "")
+        else:
+            self.fileTransferError.emit(transfer_id, error_msg)
 
-        # Reset if loop exits without success
-        if not self._connected:
-            with self._connect_lock:
-                self._connecting = False
+        # Clean up transfer data
+        with self._transfer_lock:
+            self._active_transfers.pop(transfer_id, None)
+            self._received_chunks.pop(transfer_id, None)
 
     def _ensure_connected(self):
         # use a lock to prevent race conditions on state flags
         with self._connect_lock:
-            if self._connected or self._connecting:
+            if self._conn_state != CONN_IDLE:
                 return
-            self._connecting = True
+            self._conn_state = CONN_CONNECTING
 
         def _connect():
             try:
@@ -537,9 +788,9 @@ class ChatClient(QObject):
                 self._sio.connect(self._url)
             except Exception as e:
                 print(f"[CLIENT] Connection error: {e}")
-                # if connect fails, reset the flag so we can try again
+                # if connect fails, reset the state so we can try again
                 with self._connect_lock:
-                    self._connecting = False
+                    self._conn_state = CONN_IDLE
                 self._notify_error(
                     "Unable to connect to server. Please check your network connection."
                 )
@@ -548,22 +799,31 @@ class ChatClient(QObject):
         t.start()
 
     def _emit_when_connected(self, event, data):
-        send_immediately = False
-        with self._pending_lock:
-            if self._connected:
-                send_immediately = True
-            else:
-                self._pending_events.append((event, data))
-        if send_immediately:
-            try:
-                self._sio.emit(event, data)
-            except Exception as exc:
-                print(f"[CLIENT] Failed to emit '{event}': {exc}")
-                self._notify_error(
-                    "Unable to send message. Please check your connection."
-                )
-        else:
-            self._ensure_connected()
+        # Fast path is a plain attribute read; socketio's emit is thread-safe
+        if self._conn_state != CONN_UP:
+            with self._pending_lock:
+                # Re-check under the lock: _on_connect flips the state while
+                # draining the queue
+                queued = self._conn_state != CONN_UP
+                dropped = None
+                if queued:
+                    if len(self._pending_events) == MAX_PENDING_EVENTS:
+                        # deque(maxlen) evicts silently; keep the counter true
+                        dropped = self._pending_events[0][0]
+                        self._pending_types[dropped] -= 1
+                    self._pending_events.append((event, data))
+                    self._pending_types[event] += 1
+            if dropped is not None:
+                print(f"[CLIENT] Offline queue full; dropped oldest '{dropped}'")
+                self._notify_error("Dropped oldest queued event while offline.")
+            if queued:
+                self._ensure_connected()
+                return
+        try:
+            self._sio.emit(event, data)
+        except Exception as exc:
+            print(f"[CLIENT] Failed to emit '{event}': {exc}")
+            self._notify_error("Unable to send message. Please check your connection.")
 
     def _emit_post_key(self, event: str, payload: dict):
         # If session key is confirmed, emit; otherwise queue until ack
@@ -577,6 +837,19 @@ class ChatClient(QObject):
         candidate = (file_url or "").strip()
         if not candidate:
             return None
+        # QML hands over plain local file:/// URLs almost exclusively; decode
+        # those with string ops and keep QUrl for hosts, queries/fragments,
+        # other file: spellings and other schemes.
+        is_file_url = candidate[:5].lower() == "file:"
+        if is_file_url and candidate[5:8] == "///":
+            rest = candidate[7:]
+            if "?" not in rest and "#" not in rest:
+                local = unquote(rest)
+                if sys.platform == "win32" and local[2:3] == ":":
+                    local = local[1:]
+                return Path(local)
+        elif not is_file_url and "://" not in candidate:
+            return Path(candidate)
         qurl = QUrl(candidate)
         if qurl.isValid() and qurl.scheme().lower() == "file":
             if qurl.isLocalFile():
@@ -586,48 +859,172 @@ class ChatClient(QObject):
         path = Path(candidate)
         return path
 
-    def _prepare_file_payload(self, file_path: Path) -> Optional[dict]:
+    def _probe(self, file_path: Path) -> Optional[Tuple[os.stat_result, str]]:
+        """Validate ``file_path`` as a sendable attachment from metadata alone.
+
+        Returns ``(stat_result, mime)``; rejected files are never opened. One
+        ``os.stat`` per call, with the MIME guess served from ``_guess_mime``.
+        """
         try:
-            resolved = file_path.resolve(strict=True)
-        except (OSError, RuntimeError):
+            st = os.stat(file_path)
+        except OSError:
             self._notify_error("Selected file could not be accessed.")
             return None
-
-        if not resolved.is_file():
+        if not stat.S_ISREG(st.st_mode):
             self._notify_error("Selected file is not a regular file.")
             return None
 
-        try:
-            size = resolved.stat().st_size
-        except OSError:
-            self._notify_error("Unable to determine file size.")
-            return None
-
-        if size <= 0:
+        if st.st_size <= 0:
             self._notify_error("Cannot send empty files.")
             return None
 
-        if size > MAX_FILE_BYTES:
+        if st.st_size > MAX_FILE_BYTES:
             self._notify_error("File exceeds the 5 MB limit.")
             return None
 
+        return st, _guess_mime(file_path.name)
+
+    def _prepare_file_payload(self, file_path: Path) -> Optional[dict]:
+        probed = self._probe(file_path)
+        if not probed:
+            return None
+        st, mime = probed
+        size = st.st_size
+
+        # Stream the file through the encoder so the raw bytes and the encoded
+        # copy are never held in memory at the same time.
+        out = bytearray(((size + 2) // 3) * 4)
+        offset = 0
+        buf = _read_buffer()
         try:
-            raw = resolved.read_bytes()
+            with open(file_path, "rb", buffering=0) as f:
+                while True:
+                    # A raw read may come back short (network/FUSE mounts);
+                    # fill the whole 3-byte-multiple buffer so "=" padding
+                    # can only appear in the final chunk
+                    n = 0
+                    while n < len(buf):
+                        got = f.readinto(buf[n:])
+                        if not got:
+                            break
+                        n += got
+                    if not n:
+                        break
+                    encoded_chunk = binascii.b2a_base64(buf[:n], newline=False)
+                    out[offset : offset + len(encoded_chunk)] = encoded_chunk
+                    offset += len(encoded_chunk)
+                    if n < len(buf):
+                        break  # EOF
         except OSError:
             self._notify_error("Failed to read the selected file.")
             return None
 
-        encoded = base64.b64encode(raw).decode("ascii")
-        mime, _ = mimetypes.guess_type(str(resolved))
-        mime = mime or "application/octet-stream"
+        # The file may have shrunk or grown between stat() and read()
+        if offset != len(out):
+            del out[offset:]
+        encoded = out.decode("ascii")
 
         return {
-            "name": resolved.name,
+            "name": file_path.name,
             "size": size,
             "mime": mime,
             "data": encoded,
         }
 
+    def _load_attachment(self, file_path: Path) -> Optional[dict]:
+        """Read an attachment for the encrypted transfer path (worker thread)."""
+        if not self._probe(file_path):
+            return None
+        try:
+            data = file_path.read_bytes()
+        except OSError as exc:
+            print(f"[CLIENT] Failed to read file: {exc}")
+            self._notify_error(
+                "Failed to read file. Please check if the file is accessible."
+            )
+            return None
+        return {"name": file_path.name, "data": data}
+
+    def _load_encrypted_attachment(self, file_path: Path) -> Optional[dict]:
+        """Read and AES-encrypt an attachment into send-sized chunks (worker thread).
+
+        The key used is returned alongside so the sender can tell whether the
+        session was re-keyed (reconnect) before the job finished.
+        """
+        attachment = self._load_attachment(file_path)
+        key = self._session_aes_key
+        if attachment and key:
+            attachment["encrypted"] = aes_encrypt_chunks(
+                attachment["data"], key, FILE_CHUNK_BYTES
+            )
+            attachment["key"] = key
+        return attachment
+
+    def _inspect_attachment(self, file_path: Path) -> dict:
+        probed = self._probe(file_path)
+        if not probed:
+            return {}
+        st, mime = probed
+
+        return {
+            "path": os.path.abspath(file_path),
+            "name": file_path.name,
+            "size": st.st_size,
+            "mime": mime,
+        }
+
+    def _start_file_job(self, func, file_path: Path, continuation) -> str:
+        """Run ``func(file_path)`` off the Qt thread.
+
+        ``continuation(job_id, result)`` is invoked back on the Qt thread; the
+        result is ``None`` when the job failed or rejected the file.
+        """
+        job_id = uuid.uuid4().hex
+        job = _FileJob(job_id, func, file_path)
+        job.signals.filePrepared.connect(
+            self._on_file_job_done, Qt.QueuedConnection
+        )
+        job.signals.fileFailed.connect(self._on_file_job_failed, Qt.QueuedConnection)
+        # Keep the signal emitter alive until the result has been delivered
+        self._file_jobs[job_id] = (continuation, job.signals)
+        QThreadPool.globalInstance().start(job)
+        return job_id
+
+    @Slot(str, object)
+    def _on_file_job_done(self, job_id: str, result):
+        entry = self._file_jobs.pop(job_id, None)
+        if entry:
+            continuation, _ = entry
+            continuation(job_id, result)
+
+    @Slot(str, str)
+    def _on_file_job_failed(self, job_id: str, message: str):
+        print(f"[CLIENT] File job {job_id} failed: {message}")
+        self._notify_error("Failed to process the selected file.")
+        self._on_file_job_done(job_id, None)
+
+    def _finish_inspection(self, job_id: str, info: Optional[dict]):
+        self.fileInspected.emit(job_id, info or {})
+
+    def _send_loaded_attachment(
+        self, recipient: Optional[str], job_id: str, attachment: Optional[dict]
+    ):
+        if not attachment:
+            return
+        encrypted = None
+        if attachment.get("key") is self._session_aes_key:
+            encrypted = attachment.get("encrypted")
+        transfer_id = self._send_encrypted_file_chunks(
+            attachment["data"], attachment["name"], recipient, encrypted
+        )
+        if transfer_id:
+            if recipient:
+                print(f"Started encrypted private file transfer: {transfer_id}")
+            else:
+                print(f"Started encrypted file transfer: {transfer_id}")
+        else:
+            self._notify_error("Failed to start encrypted file transfer")
+
     def _notify_error(self, message: str):
         print("Error:", message)
         self.errorReceived.emit(message)
@@ -665,22 +1062,26 @@ class ChatClient(QObject):
                     return
 
                 metadata = dict(self._active_transfers[transfer_id])
-                chunks_dict = dict(self._received_chunks[transfer_id])
+                entry = self._received_chunks[transfer_id]
+                data_bytes = entry["buf"]
+                chunks_dict = dict(entry["early"])
+                chunk_count = len(entry["seen"])
 
-            # Reassemble outside lock
-            sorted_indices = sorted(chunks_dict.keys())
-            data_bytes = b"".join(chunks_dict[i] for i in sorted_indices)
+            # Without a size up front the chunks were kept apart; join them
+            # outside the lock
+            if data_bytes is None:
+                data_bytes = b"".join(chunks_dict[i] for i in sorted(chunks_dict))
 
             self._dbg(
                 f"[BACKGROUND] Reassembled {len(data_bytes)} bytes "
-                f"from {len(sorted_indices)} chunks"
+                f"from {chunk_count} chunks"
             )
 
-            # Save to temp file
+            # Save the raw bytes to a temp file; no base64 round trip needed
             filename = metadata.get("filename", "received_file")
             temp_path = self.saveFileToTemp(
                 filename,
-                base64.b64encode(data_bytes).decode("utf-8"),
+                data_bytes,
                 metadata.get("mime", "application/octet-stream"),
             )
 
@@ -699,18 +1100,13 @@ class ChatClient(QObject):
             timestamp = metadata.get("timestamp", "")
 
             # Prepare file payload for UI
-            try:
-                import mimetypes as _m
-
-                mime, _ = _m.guess_type(filename)
-                mime = mime or "application/octet-stream"
-            except Exception:
-                mime = "application/octet-stream"
+            mime = _guess_mime(filename)
 
             file_payload = {
                 "name": filename,
                 "size": len(data_bytes),
                 "mime": mime,
+                # QML renders attachments from base64; encode exactly once
                 "data": base64.b64encode(data_bytes).decode("ascii"),
                 "is_private": is_private,
                 "recipient": recipient,
@@ -770,9 +1166,17 @@ class ChatClient(QObject):
         self._reassemble_file_background(transfer_id)
 
     def _send_encrypted_file_chunks(
-        self, file_data: bytes, filename: str, recipient: str = None
+        self,
+        file_data: bytes,
+        filename: str,
+        recipient: str = None,
+        encrypted: Optional[Tuple[bytes, bytes]] = None,
     ):
-        """Send file in encrypted chunks."""
+        """Send file in encrypted chunks.
+
+        ``encrypted`` is a ``(chunks, iv)`` pair already produced under the
+        current session key; without it the file is encrypted here.
+        """
         try:
             if not self._session_aes_key:
                 self._notify_error(
@@ -780,16 +1184,13 @@ class ChatClient(QObject):
                 )
                 return None
 
-            # Encrypt entire file with session AES key
-            ciphertext, iv = aes_encrypt(file_data, self._session_aes_key)
-            iv_b64 = base64.b64encode(iv).decode("utf-8")
+            # Encrypt with the session AES key straight into send-sized chunks
+            if encrypted is None:
+                encrypted = aes_encrypt_chunks(
+                    file_data, self._session_aes_key, FILE_CHUNK_BYTES
+                )
+            chunks, iv = encrypted
 
-            # Chunk ciphertext
-            chunk_size = 64 * 1024
-            chunks = [
-                ciphertext[i : i + chunk_size]
-                for i in range(0, len(ciphertext), chunk_size)
-            ]
             total_chunks = len(chunks)
             transfer_id = uuid.uuid4().hex
 
@@ -797,27 +1198,22 @@ class ChatClient(QObject):
             first_chunk = {
                 "transfer_id": transfer_id,
                 "chunk_index": 0,
-                "chunk_data": base64.b64encode(chunks[0]).decode("utf-8"),
+                "chunk_data": chunks[0],
                 "is_last_chunk": total_chunks == 1,
                 "metadata": {
                     "filename": filename,
                     "total_size": len(file_data),
                     "total_chunks": total_chunks,
-                    "chunk_size": chunk_size,
-                    "iv": iv_b64,
+                    "chunk_size": FILE_CHUNK_BYTES,
+                    "iv": iv,
+                    "alg": AES_ALGORITHM,
                 },
             }
             self._dbg("sending file first chunk:", transfer_id, "chunks=", total_chunks)
 
             # For private sends, optimistically show the file in the sender's private thread immediately
             if recipient:
-                try:
-                    import mimetypes as _m
-
-                    mime, _ = _m.guess_type(filename)
-                    mime = mime or "application/octet-stream"
-                except Exception:
-                    mime = "application/octet-stream"
+                mime = _guess_mime(filename)
                 sender_username = self._username or "You"
                 file_payload = {
                     "name": filename,
@@ -845,11 +1241,11 @@ class ChatClient(QObject):
                 self._emit_post_key("public_file_chunk", first_chunk)
 
             # Send remaining chunks
-            for i, chunk_data in enumerate(chunks[1:], 1):
+            for i in range(1, total_chunks):
                 chunk = {
                     "transfer_id": transfer_id,
                     "chunk_index": i,
-                    "chunk_data": base64.b64encode(chunk_data).decode("utf-8"),
+                    "chunk_data": chunks[i],
                     "is_last_chunk": i == total_chunks - 1,
                 }
                 self._dbg(
@@ -866,9 +1262,6 @@ class ChatClient(QObject):
                 else:
                     self._emit_post_key("public_file_chunk", chunk)
 
-                # Small delay to prevent overwhelming the server
-                time.sleep(0.01)
-
             return transfer_id
 
         except Exception as e:
@@ -914,6 +1307,7 @@ class ChatClient(QObject):
             ciphertext, iv = aes_encrypt(text.encode("utf-8"), self._session_aes_key)
             payload = {
                 "enc": True,
+                "alg": AES_ALGORITHM,
                 "ciphertext": base64.b64encode(ciphertext).decode("utf-8"),
                 "iv": base64.b64encode(iv).decode("utf-8"),
             }
@@ -933,6 +1327,7 @@ class ChatClient(QObject):
             payload = {
                 "recipient": recipient,
                 "enc": True,
+                "alg": AES_ALGORITHM,
                 "ciphertext": base64.b64encode(ciphertext).decode("utf-8"),
                 "iv": base64.b64encode(iv).decode("utf-8"),
             }
@@ -943,45 +1338,16 @@ class ChatClient(QObject):
                 "Failed to send private message. Please check your connection."
             )
 
-    @Slot(str, result="QVariant")
+    @Slot(str, result=str)
     def inspectFile(self, file_url: str):
+        """Inspect a file in the background; the result arrives via fileInspected."""
         file_path = self._normalize_file_path(file_url)
         if not file_path:
             self._notify_error("Invalid file selection.")
-            return {}
-        try:
-            resolved = file_path.resolve(strict=True)
-        except (OSError, RuntimeError):
-            self._notify_error("Selected file could not be accessed.")
-            return {}
-
-        if not resolved.is_file():
-            self._notify_error("Selected file is not a regular file.")
-            return {}
-
-        try:
-            size = resolved.stat().st_size
-        except OSError:
-            self._notify_error("Unable to determine file size.")
-            return {}
-
-        if size <= 0:
-            self._notify_error("Cannot send empty files.")
-            return {}
-
-        if size > MAX_FILE_BYTES:
-            self._notify_error("File exceeds the 5 MB limit.")
-            return {}
-
-        mime, _ = mimetypes.guess_type(str(resolved))
-        mime = mime or "application/octet-stream"
-
-        return {
-            "path": str(resolved),
-            "name": resolved.name,
-            "size": size,
-            "mime": mime,
-        }
+            return ""
+        return self._start_file_job(
+            self._inspect_attachment, file_path, self._finish_inspection
+        )
 
     @Slot(str)
     def register(self, username: str):
@@ -989,6 +1355,12 @@ class ChatClient(QObject):
         if not desired:
             self._notify_error("Username cannot be empty.")
             return
+        # Mirror the server's uniqueness rule (_name_key) against the roster
+        # we already hold, saving a round trip for a certain rejection
+        key = _name_key(desired)
+        if any(_name_key(name) == key for name in self._users):
+            self._notify_error(f"Username '{desired}' is already taken.")
+            return
         self._desired_username = desired
         self._emit_when_connected("register", {"username": desired})
 
@@ -1008,26 +1380,16 @@ class ChatClient(QObject):
                 self._notify_error("Invalid file selection.")
                 return
 
-            try:
-                file_data = file_path.read_bytes()
-                filename = file_path.name
+            # Send encrypted text message first if any
+            if text:
+                self._send_secure_text_message(text)
 
-                # Send encrypted text message first if any
-                if text:
-                    self._send_secure_text_message(text)
-
-                # Send encrypted file
-                transfer_id = self._send_encrypted_file_chunks(file_data, filename)
-                if transfer_id:
-                    print(f"Started encrypted file transfer: {transfer_id}")
-                else:
-                    self._notify_error("Failed to start encrypted file transfer")
-
-            except Exception as e:
-                print(f"[CLIENT] Failed to read file: {e}")
-                self._notify_error(
-                    "Failed to read file. Please check if the file is accessible."
-                )
+            # Read and encrypt off the Qt thread, then send the chunks
+            self._start_file_job(
+                self._load_encrypted_attachment,
+                file_path,
+                partial(self._send_loaded_attachment, None),
+            )
         else:
             # Encrypted text message
             if not text:
@@ -1061,28 +1423,16 @@ class ChatClient(QObject):
                 self._notify_error("Invalid file selection.")
                 return
 
-            try:
-                file_data = file_path.read_bytes()
-                filename = file_path.name
-
-                # Send encrypted text message first if any
-                if text:
-                    self._send_secure_private_message(recip, text)
+            # Send encrypted text message first if any
+            if text:
+                self._send_secure_private_message(recip, text)
 
-                # Send encrypted file
-                transfer_id = self._send_encrypted_file_chunks(
-                    file_data, filename, recip
-                )
-                if transfer_id:
-                    print(f"Started encrypted private file transfer: {transfer_id}")
-                else:
-                    self._notify_error("Failed to start encrypted file transfer")
-
-            except Exception as e:
-                print(f"[CLIENT] Failed to read file: {e}")
-                self._notify_error(
-                    "Failed to read file. Please check if the file is accessible."
-                )
+            # Read and encrypt off the Qt thread, then send the chunks
+            self._start_file_job(
+                self._load_encrypted_attachment,
+                file_path,
+                partial(self._send_loaded_attachment, recip),
+            )
         else:
             # Encrypted private text message
             if not text:
@@ -1101,25 +1451,42 @@ class ChatClient(QObject):
         """Manually disconnect from the server (user-requested)."""
         print("[CLIENT] User requested disconnect")
         self._user_requested_disconnect = True
-        self._should_reconnect = False
+        self._sio.reconnection = False
 
         try:
+            # python-socketio has no public call to cancel a pending
+            # reconnect; setting its abort event ends the retry task
+            abort = getattr(self._sio, "_reconnect_abort", None)
+            if abort is not None:
+                abort.set()
             if self._sio.connected:
                 self._sio.disconnect()
         except Exception as e:
             print(f"[CLIENT] Error during disconnect: {e}")
         finally:
             self._desired_username = ""
-            self._connected = False
-            self._connecting = False
+            with self._connect_lock:
+                self._conn_state = CONN_IDLE
 
     def _send_typing_state(
         self, context: str, is_typing: bool, recipient: Optional[str] = None
     ):
-        payload = {"context": context, "is_typing": bool(is_typing)}
-        if recipient:
-            payload["recipient"] = recipient
-        self._emit_when_connected("typing", payload)
+        # Last writer wins: rapid toggles collapse into one event per window
+        self._pending_typing[(context, recipient)] = bool(is_typing)
+        self._flush_timer.start()
+
+    @Slot()
+    def _flush_pending(self):
+        typing, self._pending_typing = self._pending_typing, {}
+        reads, self._pending_reads = self._pending_reads, {}
+        for (context, recipient), is_typing in typing.items():
+            payload = {"context": context, "is_typing": is_typing}
+            if recipient:
+                payload["recipient"] = recipient
+            self._emit_when_connected("typing", payload)
+        for recipient, message_ids in reads.items():
+            payload = {"recipient": recipient, "message_ids": sorted(message_ids)}
+            self._emit_when_connected("private_message_read", payload)
 
     @Slot(bool)
     def indicatePublicTyping(self, is_typing: bool):
@@ -1157,31 +1524,77 @@ class ChatClient(QObject):
                 continue
         if not sanitized:
             return
-        payload = {"recipient": recip, "message_ids": sanitized}
-        self._emit_when_connected("private_message_read", payload)
+        self._pending_reads.setdefault(recip, set()).update(sanitized)
+        self._flush_timer.start()
 
     @Slot(str, str, str, result=str)
     def saveFileToTemp(self, filename: str, data: str, mime: str):
-        safe_name = Path(filename or "attachment").name
         if not data:
             self._notify_error("Attachment data is missing.")
             return ""
-        try:
-            binary = base64.b64decode(data)
-        except (ValueError, TypeError):
+
+        is_binary = isinstance(data, (bytes, bytearray, memoryview))
+        if not is_binary and len(data) % 4:
             self._notify_error("Attachment could not be decoded.")
             return ""
 
-        suffix = Path(safe_name).suffix
+        suffix = os.path.splitext(os.path.basename(filename or ""))[1]
         unique_name = f"chatroom_{uuid.uuid4().hex}{suffix}"
         target = Path(tempfile.gettempdir()) / unique_name
+        if not self._write_attachment(target, data, _NEW_FILE_FLAGS, 0o600):
+            return ""
+        return QUrl.fromLocalFile(str(target)).toString()
+
+    def _write_attachment(self, target: Path, data, flags: int, mode: int) -> bool:
+        """Write raw bytes or base64 text to ``target`` via a raw descriptor.
+
+        Python callers may hand over raw bytes; QML always passes base64,
+        which is decoded in 4-character-aligned slices straight into the
+        file instead of materialising the whole decoded attachment first.
+        A partially written file is removed on failure.
+        """
+        fd = None
+        failure = None
         try:
-            target.write_bytes(binary)
+            fd = os.open(str(target), flags, mode)
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                _write_all(fd, data)
+            else:
+                for i in range(0, len(data), B64_DECODE_CHUNK):
+                    chunk = data[i : i + B64_DECODE_CHUNK]
+                    _write_all(fd, binascii.a2b_base64(chunk))
+        except (ValueError, TypeError):
+            failure = "Attachment could not be decoded."
         except OSError as exc:
-            self._notify_error(f"Failed to save file: {exc}")
-            return ""
+            failure = f"Failed to save file: {exc}"
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+        if failure:
+            if fd is not None:
+                self._remove_quietly(target)
+            self._notify_error(failure)
+            return False
+        return True
+
+    @staticmethod
+    def _remove_quietly(path: Path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
 
-        return QUrl.fromLocalFile(str(target)).toString()
+    @Slot(str, str, str)
+    def requestHistoryFile(self, file_id: str, filename: str, mime: str):
+        """Fetch an older history attachment the server keeps on disk.
+
+        The file is saved to Downloads when it arrives; see historyFileSaved.
+        """
+        if not file_id:
+            return
+        self._requested_files[file_id] = (filename or "download", mime)
+        self._emit_when_connected("request_file", {"file_id": file_id})
 
     @Slot(str, str, str, result=str)
     def saveFileToDownloads(self, filename: str, data: str, mime: str):
@@ -1189,9 +1602,7 @@ class ChatClient(QObject):
         if not data:
             self._notify_error("Attachment data is missing.")
             return ""
-        try:
-            binary = base64.b64decode(data)
-        except (ValueError, TypeError):
+        if len(data) % 4:
             self._notify_error("Attachment could not be decoded.")
             return ""
 
@@ -1224,10 +1635,7 @@ class ChatClient(QObject):
                     target = candidate
                     break
                 counter += 1
-        try:
-            target.write_bytes(binary)
-        except OSError as exc:
-            self._notify_error(f"Failed to save file: {exc}")
+        if not self._write_attachment(target, data, _NEW_FILE_FLAGS, 0o666):
             return ""
 
         return QUrl.fromLocalFile(str(target)).toString()
@@ -1237,9 +1645,7 @@ class ChatClient(QObject):
         if not data:
             self._notify_error("Attachment data is missing.")
             return ""
-        try:
-            binary = base64.b64decode(data)
-        except (ValueError, TypeError):
+        if len(data) % 4:
             self._notify_error("Attachment could not be decoded.")
             return ""
         try:
@@ -1254,11 +1660,12 @@ class ChatClient(QObject):
                     Path(target.parent).mkdir(parents=True, exist_ok=True)
                 except OSError:
                     pass
-            target.write_bytes(binary)
-            return QUrl.fromLocalFile(str(target)).toString()
         except OSError as exc:
             self._notify_error(f"Failed to save file: {exc}")
             return ""
+        if not self._write_attachment(target, data, _OVERWRITE_FILE_FLAGS, 0o666):
+            return ""
+        return QUrl.fromLocalFile(str(target)).toString()
 
     @Slot(str)
     def setAvatar(self, file_url: str):
@@ -1267,23 +1674,27 @@ class ChatClient(QObject):
             self._notify_error("Invalid avatar selection.")
             return
         try:
-            resolved = path.resolve(strict=True)
-        except (OSError, RuntimeError):
+            st = os.stat(path)
+        except OSError:
             self._notify_error("Avatar file could not be accessed.")
             return
-        if not resolved.is_file():
+        if not stat.S_ISREG(st.st_mode):
             self._notify_error("Avatar must be a regular image file.")
             return
+        if st.st_size > MAX_AVATAR_BYTES:
+            self._notify_error("Avatar must be under 128 KB.")
+            return
         try:
-            raw = resolved.read_bytes()
+            raw = path.read_bytes()
         except OSError:
             self._notify_error("Failed to read avatar file.")
             return
         if not raw or len(raw) > MAX_AVATAR_BYTES:
             self._notify_error("Avatar must be under 128 KB.")
             return
-        mime, _ = mimetypes.guess_type(str(resolved))
-        mime = mime or "image/png"
+        mime = _guess_mime(path.name)
+        if mime == "application/octet-stream":
+            mime = "image/png"  # unknown extension: assume PNG, as before
         if not mime.startswith("image/"):
             self._notify_error("Avatar must be an image.")
             return
@@ -1324,6 +1735,11 @@ class ChatClient(QObject):
 
 
 def main():
+    # Per-chunk transfer tracing is opt-in via CHAT_CLIENT_DEBUG=1
+    logging.basicConfig(
+        level=logging.DEBUG if os.environ.get("CHAT_CLIENT_DEBUG") else logging.WARNING,
+        format="[CLIENT] %(message)s",
+    )
     os.environ.setdefault("QT_QUICK_CONTROLS_STYLE", "Basic")
     app = QGuiApplication(sys.argv)
     engine = QQmlApplicationEngine()
@@ -6,11 +6,22 @@ session AES key using the server's public key.
 import os
 import base64
 import secrets
-from typing import Tuple, Optional
-from cryptography.hazmat.backends import default_backend
+import threading
+from typing import Dict, List, Tuple, Optional
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Tag sent with encrypted payloads so the server picks the matching decryptor
+AES_ALGORITHM = "gcm"
+GCM_NONCE_BYTES = 12
+# Immutable, so one instance serves every session-key wrap
+_OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None,
+)
 
 
 def fetch_server_public_key(server_url: str) -> Optional[bytes]:
@@ -44,46 +55,74 @@ def load_server_public_key_pem(server_url: Optional[str] = None) -> bytes:
     )
 
 
-def rsa_encrypt_with_server_public_key(data: bytes, server_url: Optional[str] = None) -> str:
-    pem = load_server_public_key_pem(server_url)
-    public_key = serialization.load_pem_public_key(pem, backend=default_backend())
-    encrypted = public_key.encrypt(
-        data,
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()),
-            algorithm=hashes.SHA256(),
-            label=None,
-        ),
-    )
-    return base64.b64encode(encrypted).decode("utf-8")
-
+# server_url -> parsed public key; saves an HTTP fetch + PEM parse per connect
+_public_key_cache: Dict[Optional[str], object] = {}
+_public_key_lock = threading.Lock()
 
-def generate_aes_key() -> bytes:
-    return secrets.token_bytes(32)
 
+def load_server_public_key(server_url: Optional[str] = None):
+    """Return the server's parsed public key, fetching it only once per URL."""
+    with _public_key_lock:
+        cached = _public_key_cache.get(server_url)
+    if cached is not None:
+        return cached
+    pem = load_server_public_key_pem(server_url)
+    public_key = serialization.load_pem_public_key(pem)
+    with _public_key_lock:
+        _public_key_cache[server_url] = public_key
+    return public_key
 
-def _pkcs7_pad(data: bytes, block_size: int = 16) -> bytes:
-    pad_len = block_size - (len(data) % block_size)
-    return data + bytes([pad_len] * pad_len)
 
+def forget_server_public_key(server_url: Optional[str] = None) -> None:
+    """Drop a cached key, e.g. after the server rejected a session key."""
+    with _public_key_lock:
+        _public_key_cache.pop(server_url, None)
 
-def _pkcs7_unpad(padded: bytes) -> bytes:
-    pad_len = padded[-1]
-    return padded[:-pad_len]
 
+def rsa_encrypt_with_server_public_key(data: bytes, server_url: Optional[str] = None) -> str:
+    public_key = load_server_public_key(server_url)
+    encrypted = public_key.encrypt(data, _OAEP_PADDING)
+    return base64.b64encode(encrypted).decode("utf-8")
 
-def aes_encrypt(data: bytes, key: bytes) -> Tuple[bytes, bytes]:
-    iv = secrets.token_bytes(16)
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    encryptor = cipher.encryptor()
-    padded = _pkcs7_pad(data, 16)
-    ciphertext = encryptor.update(padded) + encryptor.finalize()
-    return ciphertext, iv
 
+def generate_aes_key() -> bytes:
+    return secrets.token_bytes(32)
 
-def aes_decrypt(ciphertext: bytes, key: bytes, iv: bytes) -> bytes:
-    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-    decryptor = cipher.decryptor()
-    padded = decryptor.update(ciphertext) + decryptor.finalize()
-    return _pkcs7_unpad(padded)
 
+def aes_encrypt(data: bytes, key: bytes) -> Tuple[bytes, bytes]:
+    """AES-256-GCM encrypt ``data``; returns ``(ciphertext || tag, nonce)``.
+
+    One OpenSSL call (AES-NI + carry-less multiply where available); no
+    padding, and the 16-byte tag authenticates the payload.
+    """
+    nonce = secrets.token_bytes(GCM_NONCE_BYTES)
+    return AESGCM(key).encrypt(nonce, data, None), nonce
+
+
+def aes_encrypt_chunks(
+    data: bytes, key: bytes, chunk_size: int
+) -> Tuple[List[bytes], bytes]:
+    """AES-256-GCM encrypt ``data`` straight into ``chunk_size`` pieces.
+
+    Plaintext slices are fed through a single streaming encryptor, so the
+    full ciphertext is never built and then re-sliced. The tag is appended
+    to the last piece, giving the same ``ciphertext || tag`` byte stream as
+    :func:`aes_encrypt` once the pieces are joined.
+    """
+    nonce = secrets.token_bytes(GCM_NONCE_BYTES)
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
+    view = memoryview(data)
+    chunks = [
+        encryptor.update(view[offset : offset + chunk_size])
+        for offset in range(0, len(data), chunk_size)
+    ]
+    tail = encryptor.finalize() + encryptor.tag
+    if chunks:
+        chunks[-1] += tail
+    else:
+        chunks.append(tail)
+    return chunks, nonce
+
+
+def aes_decrypt(ciphertext: bytes, key: bytes, nonce: bytes) -> bytes:
+    return AESGCM(key).decrypt(nonce, ciphertext, None)
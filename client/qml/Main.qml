@@ -102,6 +102,7 @@ ApplicationWindow {
     property var emojiOptions: ["😀", "😂", "😍", "😎", "👍", "🙏", "🎉", "❤️", "🔥", "🤔", "🥳", "🤩", "😢", "😡"]
     property var publicPendingFile: null
     property var privatePendingFiles: ({})
+    property var pendingInspections: ({})  // inspect job id -> peer ("" for public)
     property var userAvatars: ({})
 
     // Sound notification settings
@@ -332,6 +333,15 @@ ApplicationWindow {
         privatePendingFiles = snapshot
     }
 
+    function trackInspection(jobId, peer) {
+        if (!jobId || jobId.length === 0) {
+            return
+        }
+        var snapshot = Object.assign({}, pendingInspections)
+        snapshot[jobId] = peer || ""
+        pendingInspections = snapshot
+    }
+
     function getPrivatePendingFile(peer) {
         if (!peer || peer.length === 0) {
             return null
@@ -1492,11 +1502,8 @@ ApplicationWindow {
                         target = candidate && candidate.toString ? candidate.toString() : String(candidate)
                     }
                     if (target.length > 0) {
-                        var meta = chatClient.inspectFile(target)
-                        if (meta && meta.path) {
-                            window.publicPendingFile = meta
-                            messageField.forceActiveFocus()
-                        }
+                        // Result is delivered asynchronously via onFileInspected
+                        window.trackInspection(chatClient.inspectFile(target), "")
                     }
                 }
             }
@@ -2037,14 +2044,10 @@ ApplicationWindow {
                         target = candidate && candidate.toString ? candidate.toString() : String(candidate)
                     }
                     if (target.length > 0) {
-                        var meta = chatClient.inspectFile(target)
-                        if (meta && meta.path) {
-                            pendingFile = meta
-                            window.setPrivatePendingFile(peerKey, meta)
-                            messageField.forceActiveFocus()
-                            chatClient.indicatePrivateTyping(peerKey, false)
-                            privateTypingTimer.stop()
-                        }
+                        // Result is delivered asynchronously via onFileInspected
+                        window.trackInspection(chatClient.inspectFile(target), peerKey)
+                        chatClient.indicatePrivateTyping(peerKey, false)
+                        privateTypingTimer.stop()
                     }
                 }
             }
@@ -2729,7 +2732,7 @@ ApplicationWindow {
                                 Button {
                                     text: "Download"
                                     focusPolicy: Qt.NoFocus
-                                    enabled: model.fileData && model.fileData.length > 0
+                                    enabled: (model.fileData && model.fileData.length > 0) || !!model.fileId
 
                                     background: Rectangle {
                                         radius: 8
@@ -2752,6 +2755,15 @@ ApplicationWindow {
 
                                     onClicked: {
                                         if (!model.fileData || model.fileData.length === 0) {
+                                            if (model.fileId) {
+                                                // Saved when it arrives; see onHistoryFileSaved
+                                                chatClient.requestHistoryFile(
+                                                    model.fileId,
+                                                    model.fileName || "download",
+                                                    model.fileMime || "application/octet-stream"
+                                                )
+                                                return
+                                            }
                                             console.error("[QML] Cannot download: file data is empty")
                                             return
                                         }
@@ -2806,7 +2818,7 @@ ApplicationWindow {
                                     }
 
                                     ToolTip {
-                                        visible: parent.hovered && (!model.fileData || model.fileData.length === 0)
+                                        visible: parent.hovered && (!model.fileData || model.fileData.length === 0) && !model.fileId
                                         text: "File data not available"
                                         delay: 500
                                     }
@@ -3010,6 +3022,7 @@ ApplicationWindow {
                 "fileName": file && file.name ? file.name : "",
                 "fileMime": file && file.mime ? file.mime : "",
                 "fileData": file && file.data ? file.data : "",
+                "fileId": "",
                 "fileSize": file && file.size ? Number(file.size) : 0,
                 "timestamp": formatTimestamp("")
             })
@@ -3046,6 +3059,8 @@ ApplicationWindow {
                     "fileName": entry.file && entry.file.name ? entry.file.name : "",
                     "fileMime": entry.file && entry.file.mime ? entry.file.mime : "",
                     "fileData": entry.file && entry.file.data ? entry.file.data : "",
+                    // Older bodies are kept on the server and fetched on demand
+                    "fileId": entry.file && entry.file.file_id ? entry.file.file_id : "",
                     "fileSize": entry.file && entry.file.size ? Number(entry.file.size) : 0,
                     "timestamp": formatTimestamp(entry.timestamp ? entry.timestamp : "")
                 })
@@ -3262,6 +3277,44 @@ ApplicationWindow {
             window.userAvatars = snapshot
         }
 
+        function onFileInspected(jobId, meta) {
+            if (!window.pendingInspections.hasOwnProperty(jobId)) {
+                return
+            }
+            var snapshot = Object.assign({}, window.pendingInspections)
+            var peer = snapshot[jobId]
+            delete snapshot[jobId]
+            window.pendingInspections = snapshot
+            if (!meta || !meta.path) {
+                return
+            }
+            if (peer.length > 0) {
+                window.setPrivatePendingFile(peer, meta)
+                var page = window.conversationPages[peer]
+                if (page && page.peerKey === peer) {
+                    page.pendingFile = meta
+                }
+            } else {
+                window.publicPendingFile = meta
+            }
+            window.focusActiveComposer()
+        }
+
+        function onHistoryFileSaved(filename, result) {
+            messagesModel.append({
+                "user": "System",
+                "text": result && result.length > 0
+                    ? "File downloaded successfully: " + filename
+                    : "Failed to download file: " + filename,
+                "isPrivate": false,
+                "fileName": "",
+                "fileMime": "",
+                "fileData": "",
+                "fileSize": 0,
+                "timestamp": formatTimestamp("")
+            })
+        }
+
         function onFileTransferComplete(transferId, filename) {
             console.log("[QML] File transfer complete:", transferId, filename)
             window.clearDownload(transferId)
@@ -2,7 +2,6 @@ import os
 from pathlib import Path
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.backends import default_backend
 
 
 def ensure_directories():
@@ -18,7 +17,6 @@ def generate_server_keys():
     private_key = rsa.generate_private_key(
         public_exponent=65537,
         key_size=2048,
-        backend=default_backend(),
     )
     public_key = private_key.public_key()
 
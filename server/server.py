@@ -3,54 +3,138 @@ from flask import Flask
 import logging
 import os
 import threading
+import unicodedata
+import uuid
+from collections import deque
+from types import MappingProxyType
 
 # from dotenv import load_dotenv
 import base64
 from datetime import datetime, timezone
-from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding, rsa
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import padding as sym_padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+try:
+    import orjson  # optional: faster Socket.IO packet (de)serialisation
+except ImportError:
+    orjson = None
 
 
 MAX_PUBLIC_HISTORY = 200
 MAX_FILE_BYTES = 5 * 1024 * 1024  # 5 MB safety cap
+MAX_B64_LEN = (MAX_FILE_BYTES * 4) // 3 + 8  # encoded length of a capped file
+# Base64 file bodies kept in memory by public history; older bodies are
+# spilled to disk and fetched on demand with "request_file"
+HISTORY_FILE_BUDGET = 8 * MAX_B64_LEN
+# Binary uploads at least this big are base64-encoded off the eventlet hub
+OFFLOAD_ENCODE_BYTES = 256 * 1024
+# Read receipts only ever refer to recent private messages, so their
+# bookkeeping lives in a fixed ring (power of two) instead of growing forever
+PRIVATE_MESSAGE_RING = 1 << 16
+TYPING_FLUSH_SECONDS = 0.05  # coalescing window for typing broadcasts
+# Immutable, so one instance serves every session-key unwrap
+_OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None,
+)
+
+
+class _OrjsonCodec:
+    """``json``-module stand-in handed to python-socketio when orjson exists."""
+
+    @staticmethod
+    def dumps(obj, **_kwargs):
+        # socketio passes stdlib-only kwargs (separators); orjson is compact
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    @staticmethod
+    def loads(data, **_kwargs):
+        return orjson.loads(data)
+
+
+def _clamp_field(value, limit=255):
+    # Common case is already a short str; skip the str() + slice copy then
+    if isinstance(value, str) and len(value) <= limit:
+        return value
+    return str(value)[:limit]
+
+
+def _name_key(username):
+    # "Alice", "ALICE" and compatibility forms like full-width letters collide
+    return unicodedata.normalize("NFKC", username).casefold()
 
 
 def _sanitize_file_payload(data):
-    """Validate and clamp incoming file payloads."""
+    """Validate and clamp incoming file payloads.
+
+    ``data`` may be a base64 string or raw bytes (a binary attachment);
+    bytes are returned as-is for the caller to encode with ``_b64_text``.
+    """
     if not isinstance(data, dict):
         return None
 
-    name = str(data.get("name", ""))[:255]
-    mime = str(data.get("mime", "application/octet-stream"))[:255]
-    size = data.get("size", 0)
-    try:
-        size = int(size)
-    except (TypeError, ValueError):
-        size = 0
-
+    # Cheapest rejections first; name/mime are only built once data passes
     b64_data = data.get("data")
-    if not isinstance(b64_data, str) or not b64_data:
+    if not b64_data or not isinstance(b64_data, (str, bytes, bytearray)):
         return None
 
+    name = _clamp_field(data.get("name", ""))
+    if isinstance(b64_data, str):
+        if len(b64_data) > MAX_B64_LEN:
+            logging.warning("Rejected file '%s' due to encoded length", name)
+            return None
+
+        size = data.get("size", 0)
+        if type(size) is not int:
+            try:
+                size = int(size)
+            except (TypeError, ValueError):
+                size = 0
+    else:
+        # Binary attachment: no base64 inflation, and its length is the size
+        size = len(b64_data)
+
     if size > MAX_FILE_BYTES:
         logging.warning("Rejected file '%s' exceeding size cap", name)
         return None
 
-    if len(b64_data) > (MAX_FILE_BYTES * 4) // 3 + 8:
-        logging.warning("Rejected file '%s' due to encoded length", name)
-        return None
-
     return {
         "name": name,
-        "mime": mime,
+        "mime": _clamp_field(data.get("mime", "application/octet-stream")),
         "size": size,
         "data": b64_data,
     }
 
 
+def _history_file_len(entry):
+    file_info = entry.get("file")
+    return len(file_info.get("data", "")) if file_info else 0
+
+
+def _b64_text(raw):
+    return base64.b64encode(raw).decode("ascii")
+
+
+def _read_text(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _preencode_file(file_payload):
+    """Return ``file_payload`` with its base64 body JSON-encoded once for reuse."""
+    # orjson >= 3.9 embeds a Fragment verbatim, so the multi-MB string is only
+    # escaped once however many packets carry it
+    fragment = getattr(orjson, "Fragment", None)
+    if fragment is None:
+        return file_payload
+    return dict(file_payload, data=fragment(orjson.dumps(file_payload["data"])))
+
+
 # Load environment variables from .env file
 # load_dotenv()
 
@@ -65,15 +149,40 @@ class ChatServer:
         self.sio = socketio.Server(
             cors_allowed_origins="*",
             max_http_buffer_size=MAX_FILE_BYTES * 2,
+            json=_OrjsonCodec if orjson is not None else None,
+            # Handle each client's events in arrival order on its own green
+            # thread; work offloaded via _run_blocking yields, and a later
+            # small message must not overtake the upload before it
+            async_handlers=False,
         )
         self.app = Flask(__name__)
         self.app.wsgi_app = socketio.WSGIApp(self.sio, self.app.wsgi_app)
         self.clients = {}
+        # Read-only snapshot of ``clients`` republished on every roster change,
+        # so handlers can look up a sender's name without taking the lock
+        self.clients_view = MappingProxyType({})
+        # update_user_list payload for the current roster; never mutated
+        self.users_payload = {"users": []}
+        # Reverse index for recipient lookups, and _name_key forms for the
+        # uniqueness check; both kept in step with ``clients`` under ``clients_lock``
+        self.username_to_sid = {}
+        self.taken_names = set()
         self.test = test
-        self.lock = threading.Lock()  # Lock for thread-safe operations on clients dict
-        self.public_history = []
+        # Separate locks so history appends, private-message bookkeeping and
+        # roster lookups never wait on each other; none is taken inside another.
+        # Locks guard multi-step updates only: a single dict .get() is atomic,
+        # so lookups in session_keys/username_to_sid/clients_view skip them
+        self.clients_lock = threading.Lock()  # clients, name indexes, session_keys
+        self.history_lock = threading.Lock()  # public_history + its payload cache
+        self.pm_lock = threading.Lock()  # private_message_counter, private_messages
+        self.public_history = deque(maxlen=MAX_PUBLIC_HISTORY)
+        # chat_history payload shared by every connect/register until the next
+        # message invalidates it; treated as immutable once built
+        self.history_payload_cache = None
+        self.history_file_bytes = 0  # base64 chars of file bodies in history
+        self.history_spills = set()  # file_ids of bodies spilled to history_dir
         self.private_message_counter = 0
-        self.private_messages = {}
+        self.private_messages = [None] * PRIVATE_MESSAGE_RING
         self.session_keys = {}  # sid -> AES key (bytes)
         # Uploads directory for caching plaintext files
         self.upload_dir = os.path.join(os.path.dirname(__file__), "uploads")
@@ -81,6 +190,20 @@ class ChatServer:
             os.makedirs(self.upload_dir, exist_ok=True)
         except OSError:
             pass
+        # History is not persisted, so spills left by a previous run are stale
+        self.history_dir = os.path.join(self.upload_dir, "history")
+        try:
+            os.makedirs(self.history_dir, exist_ok=True)
+            for stale in os.listdir(self.history_dir):
+                os.remove(os.path.join(self.history_dir, stale))
+        except OSError:
+            pass
+
+        # Typing state waiting for the next flush: (context, sid, recipient_sid)
+        # -> (username, is_typing); later toggles overwrite earlier ones
+        self.pending_typing = {}
+        self.typing_flush_scheduled = False
+        self.typing_lock = threading.Lock()
 
         # File transfer tracking
         self.active_file_transfers = {}  # transfer_id -> transfer_info
@@ -94,13 +217,9 @@ class ChatServer:
         priv_path = os.path.join(base_dir, "private_key.pem")
         if os.path.exists(priv_path):
             with open(priv_path, "rb") as f:
-                return serialization.load_pem_private_key(
-                    f.read(), password=None, backend=default_backend()
-                )
+                return serialization.load_pem_private_key(f.read(), password=None)
         # Generate a new RSA key if missing (first boot)
-        key = rsa.generate_private_key(
-            public_exponent=65537, key_size=2048, backend=default_backend()
-        )
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
         private_pem = key.private_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PrivateFormat.TraditionalOpenSSL,
@@ -128,27 +247,182 @@ class ChatServer:
             pass
         return key
 
-    @staticmethod
-    def _pkcs7_unpad(padded: bytes) -> bytes:
-        pad_len = padded[-1]
-        return padded[:-pad_len]
+    def _history_payload(self):
+        """Return the chat_history payload, rebuilt only after history changes."""
+        with self.history_lock:
+            if self.history_payload_cache is None:
+                self.history_payload_cache = {"messages": list(self.public_history)}
+            return self.history_payload_cache
+
+    def _append_history(self, entry):
+        """Append to public history, keeping in-memory file bodies within budget."""
+        # Caller holds self.history_lock
+        history = self.public_history
+        if len(history) == history.maxlen:
+            # The bounded deque is about to drop this entry itself
+            dropped = history[0]
+            self.history_file_bytes -= _history_file_len(dropped)
+            self._discard_spill(dropped)
+        history.append(entry)
+        self.history_file_bytes += _history_file_len(entry)
+        self.history_payload_cache = None
+
+        # Spill the oldest bodies (never the new one); entries are replaced,
+        # not mutated, since earlier payloads may still be in flight
+        index = 0
+        while (
+            self.history_file_bytes > HISTORY_FILE_BUDGET
+            and index < len(history) - 1
+        ):
+            old_entry = history[index]
+            body_len = _history_file_len(old_entry)
+            if body_len:
+                file_info = dict(old_entry["file"])
+                file_id = self._spill_body(file_info.pop("data"))
+                if file_id:
+                    file_info["file_id"] = file_id
+                history[index] = dict(old_entry, file=file_info)
+                self.history_file_bytes -= body_len
+            index += 1
+
+    def _spill_body(self, body):
+        """Write a history file body to disk; return its id, or None on failure."""
+        # Caller holds self.history_lock. The write never yields to the hub,
+        # so holding the lock across it cannot stall other green threads
+        file_id = uuid.uuid4().hex
+        try:
+            with open(os.path.join(self.history_dir, file_id), "w") as f:
+                f.write(body)
+        except OSError as e:
+            logging.error(f"Failed to spill history file body: {e}")
+            return None
+        self.history_spills.add(file_id)
+        return file_id
+
+    def _discard_spill(self, entry):
+        # Caller holds self.history_lock
+        file_info = entry.get("file")
+        file_id = file_info.get("file_id") if file_info else None
+        if file_id in self.history_spills:
+            self.history_spills.discard(file_id)
+            try:
+                os.remove(os.path.join(self.history_dir, file_id))
+            except OSError:
+                pass
+
+    def _publish_clients(self):
+        """Republish the roster snapshot and return the update_user_list payload."""
+        # Caller holds self.clients_lock; swapping the attributes is atomic.
+        # The payload is rebuilt only here, i.e. once per membership change
+        self.clients_view = MappingProxyType(dict(self.clients))
+        self.users_payload = {"users": list(self.clients.values())}
+        return self.users_payload
+
+    def _unindex_username(self, username):
+        # Caller holds self.clients_lock
+        self.username_to_sid.pop(username, None)
+        self.taken_names.discard(_name_key(username))
+
+    def _queue_typing(self, key, username, is_typing):
+        """Record a typing state; one flush per window emits the latest of each."""
+        with self.typing_lock:
+            self.pending_typing[key] = (username, is_typing)
+            if self.typing_flush_scheduled:
+                return
+            self.typing_flush_scheduled = True
+        self.sio.start_background_task(self._flush_typing)
+
+    def _flush_typing(self):
+        self.sio.sleep(TYPING_FLUSH_SECONDS)
+        with self.typing_lock:
+            pending = self.pending_typing
+            self.pending_typing = {}
+            self.typing_flush_scheduled = False
+        for (context, sid, recipient_sid), (username, is_typing) in pending.items():
+            payload = {"username": username, "is_typing": is_typing}
+            if context == "public":
+                self.sio.emit("public_typing", payload, skip_sid=sid)
+            else:
+                self.sio.emit("private_typing", payload, to=recipient_sid)
 
     @staticmethod
-    def _aes_decrypt(ciphertext: bytes, key: bytes, iv: bytes) -> bytes:
-        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+    def _aes_decrypt(ciphertext: bytes, key: bytes, iv: bytes, alg=None) -> bytes:
+        # Current clients send AES-GCM ("alg": "gcm"); untagged payloads come
+        # from older clients that still use CBC + PKCS7
+        if alg == "gcm":
+            return AESGCM(key).decrypt(iv, ciphertext, None)
+        cipher = Cipher(algorithms.AES(key), modes.CBC(iv))
         decryptor = cipher.decryptor()
-        padded = decryptor.update(ciphertext) + decryptor.finalize()
-        return ChatServer._pkcs7_unpad(padded)
+        # Feed the decryptor output straight into the C unpadder, which also
+        # rejects malformed padding instead of silently truncating
+        unpadder = sym_padding.PKCS7(algorithms.AES.block_size).unpadder()
+        return (
+            unpadder.update(decryptor.update(ciphertext))
+            + unpadder.update(decryptor.finalize())
+            + unpadder.finalize()
+        )
+
+    def _read_message_body(self, sid, data):
+        """Decrypt/validate a message event in one pass.
+
+        Returns ``(text, file_payload)`` with ``text`` stripped, or ``None``
+        after reporting a decrypt error to the sender.
+        """
+        file_payload = None
+        if data.get("enc"):
+            try:
+                key = self.session_keys.get(sid)
+                if not key:
+                    self.sio.emit(
+                        "error", {"message": "Session key not found."}, to=sid
+                    )
+                    return None
+                ct = base64.b64decode(data.get("ciphertext", ""))
+                iv = base64.b64decode(data.get("iv", ""))
+                text = ChatServer._aes_decrypt(ct, key, iv, data.get("alg")).decode(
+                    "utf-8", errors="replace"
+                )
+            except Exception as e:
+                self.sio.emit("error", {"message": f"Decrypt failed: {e}"}, to=sid)
+                return None
+        else:
+            text = data.get("message")
+            file_payload = _sanitize_file_payload(data.get("file"))
+            if file_payload and not isinstance(file_payload["data"], str):
+                # Receivers and chat history still expect base64 text; a
+                # multi-MB encode would stall every other green thread
+                raw = file_payload["data"]
+                if len(raw) >= OFFLOAD_ENCODE_BYTES:
+                    file_payload["data"] = self._run_blocking(_b64_text, raw)
+                else:
+                    file_payload["data"] = _b64_text(raw)
+
+        text = text.strip() if isinstance(text, str) else ""
+        return text, file_payload
+
+    @staticmethod
+    def _decrypt_transfer(chunks_dict, key, iv, alg=None):
+        ciphertext = b"".join(chunks_dict[i] for i in sorted(chunks_dict.keys()))
+        return ChatServer._aes_decrypt(ciphertext, key, iv, alg)
+
+    def _run_blocking(self, fn, *args):
+        """Call ``fn`` in eventlet's native thread pool when serving on eventlet."""
+        # The test harness runs the hub off the main thread, where tpool
+        # cannot shut down cleanly at exit
+        if self.sio.async_mode == "eventlet" and not self.test:
+            from eventlet import tpool
+
+            return tpool.execute(fn, *args)
+        return fn(*args)
 
     def register_events(self):
 
         @self.sio.event
         def connect(sid, environ):
-            logging.info(f"Client connected: {sid}")
-            with self.lock:
-                history_snapshot = list(self.public_history)
-            if history_snapshot:
-                self.sio.emit("chat_history", {"messages": history_snapshot}, to=sid)
+            logging.info("Client connected: %s", sid)
+            history_payload = self._history_payload()
+            if history_payload["messages"]:
+                self.sio.emit("chat_history", history_payload, to=sid)
             # Ensure private key is loaded
             try:
                 if not hasattr(self, "_private_key"):
@@ -191,25 +465,29 @@ class ChatServer:
 
         @self.sio.event
         def disconnect(sid):
-            logging.info(f"Client disconnected: {sid}")
-            with self.lock:
+            logging.info("Client disconnected: %s", sid)
+            # Mutate and snapshot under the lock, emit after releasing it so a
+            # slow socket never holds up other handlers waiting on the roster
+            with self.clients_lock:
                 username = self.clients.pop(sid, None)
                 self.session_keys.pop(sid, None)
-                if username:
-                    # Notify remaining clients by sending the updated user list
-                    self.sio.emit(
-                        "update_user_list", {"users": list(self.clients.values())}
-                    )
-                    logging.info(f"User left: {username}")
-
-                    # Send system notification that user left
-                    server_ts = datetime.now(timezone.utc).isoformat()
-                    system_message = {
-                        "username": "System",
-                        "message": f"{username} has left the chat",
-                        "timestamp": server_ts,
-                    }
-                    self.sio.emit("message", system_message)
+                if not username:
+                    return
+                self._unindex_username(username)
+                users_payload = self._publish_clients()
+
+            # Notify remaining clients by sending the updated user list
+            self.sio.emit("update_user_list", users_payload)
+            logging.info("User left: %s", username)
+
+            # Send system notification that user left
+            server_ts = datetime.now(timezone.utc).isoformat()
+            system_message = {
+                "username": "System",
+                "message": f"{username} has left the chat",
+                "timestamp": server_ts,
+            }
+            self.sio.emit("message", system_message)
 
         @self.sio.event
         def register(sid, data):
@@ -221,38 +499,46 @@ class ChatServer:
                     "error", {"message": "A valid username is required."}, to=sid
                 )
                 logging.warning(
-                    f"Invalid registration attempt from {sid} with username: {username}"
+                    "Invalid registration attempt from %s with username: %s",
+                    sid,
+                    username,
                 )
                 return
 
             username = username.strip()
 
-            with self.lock:
-                # Enforce unique usernames (case-insensitive)
-                if any(
-                    (name or "").lower() == username.lower()
-                    for name in self.clients.values()
-                ):
-                    self.sio.emit(
-                        "error",
-                        {"message": f"Username '{username}' is already taken."},
-                        to=sid,
-                    )
-                    logging.warning(
-                        f"Registration failed for {sid}: username '{username}' taken."
-                    )
-                    return
+            # Enforce unique usernames (case- and width-insensitive)
+            name_key = _name_key(username)
+            with self.clients_lock:
+                taken = name_key in self.taken_names
+                if not taken:
+                    previous = self.clients.get(sid)
+                    if previous:
+                        self._unindex_username(previous)
+                    self.clients[sid] = username
+                    self.username_to_sid[username] = sid
+                    self.taken_names.add(name_key)
+                    users_payload = self._publish_clients()
+
+            if taken:
+                self.sio.emit(
+                    "error",
+                    {"message": f"Username '{username}' is already taken."},
+                    to=sid,
+                )
+                logging.warning(
+                    "Registration failed for %s: username '%s' taken.", sid, username
+                )
+                return
 
-                self.clients[sid] = username
-                users_snapshot = list(self.clients.values())
-                history_snapshot = list(self.public_history)
+            history_payload = self._history_payload()
 
             # Notify all clients (including the new one) with the updated user list
-            self.sio.emit("update_user_list", {"users": users_snapshot})
-            logging.info(f"User registered: {username} with SID: {sid}")
+            self.sio.emit("update_user_list", users_payload)
+            logging.info("User registered: %s with SID: %s", username, sid)
 
-            if history_snapshot:
-                self.sio.emit("chat_history", {"messages": history_snapshot}, to=sid)
+            if history_payload["messages"]:
+                self.sio.emit("chat_history", history_payload, to=sid)
 
         @self.sio.event
         def session_key(sid, data):
@@ -264,17 +550,10 @@ class ChatServer:
                 return
             try:
                 enc_bytes = base64.b64decode(enc_key_b64.encode("utf-8"))
-                aes_key = self._private_key.decrypt(
-                    enc_bytes,
-                    padding.OAEP(
-                        mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                        algorithm=hashes.SHA256(),
-                        label=None,
-                    ),
-                )
-                with self.lock:
+                aes_key = self._private_key.decrypt(enc_bytes, _OAEP_PADDING)
+                with self.clients_lock:
                     self.session_keys[sid] = aes_key
-                logging.info(f"Stored session AES key for {sid}")
+                logging.info("Stored session AES key for %s", sid)
                 # Acknowledge to client so it can start sending encrypted payloads
                 self.sio.emit("session_key_ok", {"ok": True}, to=sid)
             except Exception as e:
@@ -284,40 +563,17 @@ class ChatServer:
         @self.sio.event
         def message(sid, data):
             """Handle incoming messages from a client and broadcast them."""
-            with self.lock:
-                sender_username = self.clients.get(sid, "Unknown")
-
-            # Decrypt if encrypted
-            file_payload = None
-            if data.get("enc"):
-                try:
-                    key = self.session_keys.get(sid)
-                    if not key:
-                        self.sio.emit(
-                            "error", {"message": "Session key not found."}, to=sid
-                        )
-                        return
-                    ct = base64.b64decode(data.get("ciphertext", ""))
-                    iv = base64.b64decode(data.get("iv", ""))
-                    message_text = ChatServer._aes_decrypt(ct, key, iv).decode(
-                        "utf-8", errors="replace"
-                    )
-                except Exception as e:
-                    self.sio.emit("error", {"message": f"Decrypt failed: {e}"}, to=sid)
-                    return
-            else:
-                message_text = data.get("message")
-                file_payload = _sanitize_file_payload(data.get("file"))
+            sender_username = self.clients_view.get(sid, "Unknown")
 
-            if isinstance(message_text, str):
-                message_text = message_text.strip()
-            else:
-                message_text = ""
+            body = self._read_message_body(sid, data)
+            if body is None:
+                return
+            message_text, file_payload = body
 
             # Input validation
             if not message_text and not file_payload:
                 logging.warning(
-                    f"Empty message payload from {sender_username} ({sid}) ignored."
+                    "Empty message payload from %s (%s) ignored.", sender_username, sid
                 )
                 return
 
@@ -335,10 +591,8 @@ class ChatServer:
                 if file_payload:
                     broadcast_data["file"] = file_payload
 
-                with self.lock:
-                    self.public_history.append(broadcast_data)
-                    if len(self.public_history) > MAX_PUBLIC_HISTORY:
-                        self.public_history.pop(0)
+                with self.history_lock:
+                    self._append_history(broadcast_data)
 
                 # Emit to all clients. By removing `skip_sid`, the sender will also receive their own message.
                 self.sio.emit("message", broadcast_data)
@@ -346,31 +600,13 @@ class ChatServer:
         @self.sio.event
         def private_message(sid, data):
             """Handle private messages between users."""
-            with self.lock:
-                sender_username = self.clients.get(sid, "Unknown")
+            sender_username = self.clients_view.get(sid, "Unknown")
 
             recipient_username = data.get("recipient")
-            # Decrypt if encrypted
-            file_payload = None
-            if data.get("enc"):
-                try:
-                    key = self.session_keys.get(sid)
-                    if not key:
-                        self.sio.emit(
-                            "error", {"message": "Session key not found."}, to=sid
-                        )
-                        return
-                    ct = base64.b64decode(data.get("ciphertext", ""))
-                    iv = base64.b64decode(data.get("iv", ""))
-                    message = ChatServer._aes_decrypt(ct, key, iv).decode(
-                        "utf-8", errors="replace"
-                    )
-                except Exception as e:
-                    self.sio.emit("error", {"message": f"Decrypt failed: {e}"}, to=sid)
-                    return
-            else:
-                message = data.get("message")
-                file_payload = _sanitize_file_payload(data.get("file"))
+            body = self._read_message_body(sid, data)
+            if body is None:
+                return
+            message, file_payload = body
 
             # Input validation
             if (
@@ -383,11 +619,6 @@ class ChatServer:
                 )
                 return
 
-            if isinstance(message, str):
-                message = message.strip()
-            else:
-                message = ""
-
             if not message and not file_payload:
                 self.sio.emit(
                     "error",
@@ -398,8 +629,11 @@ class ChatServer:
                 )
                 return
 
-            logging.info(
-                f"Private message request from {sender_username} to {recipient_username}"
+            # Per-message chatter stays at DEBUG; args are only formatted if shown
+            logging.debug(
+                "Private message request from %s to %s",
+                sender_username,
+                recipient_username,
             )
 
             # Prevent users from sending messages to themselves
@@ -410,46 +644,51 @@ class ChatServer:
                     to=sid,
                 )
                 logging.warning(
-                    f"Private message failed: {sender_username} tried to message themselves."
+                    "Private message failed: %s tried to message themselves.",
+                    sender_username,
                 )
                 return
 
             if recipient_username and message:
                 # Find the recipient's socket ID
-                recipient_sid = None
-                with self.lock:
-                    for client_sid, username in self.clients.items():
-                        if username == recipient_username:
-                            recipient_sid = client_sid
-                            break
+                recipient_sid = self.username_to_sid.get(recipient_username)
 
                 if recipient_sid:
                     server_ts = data.get("timestamp")
                     if not server_ts:
                         server_ts = datetime.now(timezone.utc).isoformat()
-                    with self.lock:
+                    with self.pm_lock:
                         self.private_message_counter += 1
                         message_id = self.private_message_counter
-                        self.private_messages[message_id] = {
+                        slot = message_id & (PRIVATE_MESSAGE_RING - 1)
+                        self.private_messages[slot] = {
+                            "id": message_id,
                             "sender_sid": sid,
                             "recipient_sid": recipient_sid,
                             "status": "sent",
                         }
 
-                    # Send private message to recipient only
-                    payload = {
+                    # Build the two copies directly rather than cloning a
+                    # template; the file payload is shared by reference and
+                    # its base64 body serialized once for both emits
+                    recipient_payload = {
                         "sender": sender_username,
                         "recipient": recipient_username,
                         "message": message,
                         "timestamp": server_ts,
+                        "message_id": message_id,
+                        "status": "delivered",
+                    }
+                    sender_payload = {
+                        "sender": sender_username,
+                        "recipient": recipient_username,
+                        "message": message,
+                        "timestamp": server_ts,
+                        "message_id": message_id,
+                        "status": "sent",
                     }
-
-                    payload["message_id"] = message_id
-                    recipient_payload = dict(payload)
-                    recipient_payload["status"] = "delivered"
-                    sender_payload = dict(payload)
-                    sender_payload["status"] = "sent"
                     if file_payload:
+                        file_payload = _preencode_file(file_payload)
                         recipient_payload["file"] = file_payload
                         sender_payload["file"] = file_payload
 
@@ -457,8 +696,10 @@ class ChatServer:
                         "private_message_received", recipient_payload, to=recipient_sid
                     )
                     self.sio.emit("private_message_sent", sender_payload, to=sid)
-                    logging.info(
-                        f"Private message delivered from {sender_username} to {recipient_username}"
+                    logging.debug(
+                        "Private message delivered from %s to %s",
+                        sender_username,
+                        recipient_username,
                     )
                 else:
                     # Recipient not found - send error back to sender
@@ -470,7 +711,9 @@ class ChatServer:
                         to=sid,
                     )
                     logging.warning(
-                        f"Private message failed: {recipient_username} not found for sender {sender_username}"
+                        "Private message failed: %s not found for sender %s",
+                        recipient_username,
+                        sender_username,
                     )
             else:
                 # Invalid message data - send error back to sender
@@ -482,19 +725,40 @@ class ChatServer:
                     to=sid,
                 )
                 logging.warning(
-                    f"Private message failed: invalid format from {sender_username}"
+                    "Private message failed: invalid format from %s", sender_username
                 )
 
         @self.sio.event
         def request_history(sid, data=None):
-            with self.lock:
-                history_snapshot = list(self.public_history)
-            self.sio.emit("chat_history", {"messages": history_snapshot}, to=sid)
+            self.sio.emit("chat_history", self._history_payload(), to=sid)
+
+        @self.sio.event
+        def request_file(sid, data):
+            """Send back a history file body that was spilled to disk."""
+            file_id = data.get("file_id") if isinstance(data, dict) else None
+            if not isinstance(file_id, str):
+                return
+            # Only ids we issued map to files, so the id is safe as a filename
+            with self.history_lock:
+                known = file_id in self.history_spills
+            body = None
+            if known:
+                try:
+                    body = self._run_blocking(
+                        _read_text, os.path.join(self.history_dir, file_id)
+                    )
+                except OSError:
+                    pass  # evicted from history meanwhile
+            if body is None:
+                self.sio.emit(
+                    "error", {"message": "File is no longer available."}, to=sid
+                )
+                return
+            self.sio.emit("history_file", {"file_id": file_id, "data": body}, to=sid)
 
         @self.sio.event
         def typing(sid, data):
-            with self.lock:
-                username = self.clients.get(sid)
+            username = self.clients_view.get(sid)
 
             if not username:
                 logging.warning("Typing event from unknown SID: %s", sid)
@@ -504,28 +768,17 @@ class ChatServer:
             is_typing = bool(data.get("is_typing"))
 
             if context == "public":
-                self.sio.emit(
-                    "public_typing",
-                    {"username": username, "is_typing": is_typing},
-                    skip_sid=sid,
-                )
+                self._queue_typing(("public", sid, None), username, is_typing)
             elif context == "private":
                 recipient_username = data.get("recipient")
                 if not recipient_username:
                     return
 
-                recipient_sid = None
-                with self.lock:
-                    for client_sid, name in self.clients.items():
-                        if name == recipient_username:
-                            recipient_sid = client_sid
-                            break
+                recipient_sid = self.username_to_sid.get(recipient_username)
 
                 if recipient_sid:
-                    self.sio.emit(
-                        "private_typing",
-                        {"username": username, "is_typing": is_typing},
-                        to=recipient_sid,
+                    self._queue_typing(
+                        ("private", sid, recipient_sid), username, is_typing
                     )
             else:
                 logging.debug(
@@ -543,17 +796,25 @@ class ChatServer:
             if not isinstance(message_ids, list):
                 message_ids = [message_ids]
 
-            acknowledgements = []
-
-            with self.lock:
-                for raw_id in message_ids:
-                    try:
-                        message_id = int(raw_id)
-                    except (TypeError, ValueError):
-                        continue
+            # Parse ids before taking the lock; only status flips need it
+            parsed_ids = []
+            for raw_id in message_ids:
+                try:
+                    parsed_ids.append(int(raw_id))
+                except (TypeError, ValueError):
+                    continue
+            if not parsed_ids:
+                return
 
-                    message_meta = self.private_messages.get(message_id)
-                    if not message_meta:
+            acknowledgements = []
+            ring = self.private_messages
+            mask = PRIVATE_MESSAGE_RING - 1
+
+            with self.pm_lock:
+                for message_id in parsed_ids:
+                    message_meta = ring[message_id & mask]
+                    # The slot may since have been reused by a newer message
+                    if not message_meta or message_meta["id"] != message_id:
                         continue
 
                     if message_meta.get("recipient_sid") != sid:
@@ -567,11 +828,21 @@ class ChatServer:
                         (message_meta.get("sender_sid"), message_id)
                     )
 
+            # One packet per sender: a lone receipt keeps the original event,
+            # several go out together as a batch
+            grouped = {}
             for sender_sid, message_id in acknowledgements:
                 if sender_sid:
-                    self.sio.emit(
-                        "private_message_read",
-                        {"message_id": message_id},
+                    grouped.setdefault(sender_sid, []).append(message_id)
+
+            emit = self.sio.emit
+            for sender_sid, ids in grouped.items():
+                if len(ids) == 1:
+                    emit("private_message_read", {"message_id": ids[0]}, to=sender_sid)
+                else:
+                    emit(
+                        "private_message_read_batch",
+                        {"message_ids": ids},
                         to=sender_sid,
                     )
 
@@ -595,23 +866,21 @@ class ChatServer:
             error_msg = data.get("error", "")
 
             with self.file_transfer_lock:
-                if transfer_id in self.active_file_transfers:
-                    transfer_info = self.active_file_transfers[transfer_id]
-
-                    # Forward acknowledgment to sender
-                    if transfer_info.get("sender_sid"):
-                        self.sio.emit(
-                            "file_transfer_ack",
-                            {
-                                "transfer_id": transfer_id,
-                                "success": success,
-                                "error": error_msg,
-                            },
-                            to=transfer_info["sender_sid"],
-                        )
-
-                    # Clean up transfer
-                    del self.active_file_transfers[transfer_id]
+                transfer_info = self.active_file_transfers.pop(transfer_id, None)
+            if transfer_info is None:
+                return
+
+            # Forward acknowledgment to sender
+            if transfer_info.get("sender_sid"):
+                self.sio.emit(
+                    "file_transfer_ack",
+                    {
+                        "transfer_id": transfer_id,
+                        "success": success,
+                        "error": error_msg,
+                    },
+                    to=transfer_info["sender_sid"],
+                )
 
     def _handle_file_chunk(self, sid, data, is_private=False):
         """Handle encrypted file chunks."""
@@ -622,13 +891,23 @@ class ChatServer:
         metadata = data.get("metadata")
         recipient = data.get("recipient") if is_private else None
 
-        with self.lock:
-            sender_username = self.clients.get(sid, "Unknown")
+        sender_username = self.clients_view.get(sid, "Unknown")
 
         if not all([transfer_id, chunk_index is not None, chunk_data]):
             self.sio.emit("error", {"message": "Invalid file chunk"}, to=sid)
             return
 
+        # Binary attachment from current clients, base64 from older ones
+        if isinstance(chunk_data, str):
+            try:
+                chunk_data = base64.b64decode(chunk_data)
+            except ValueError:
+                self.sio.emit("error", {"message": "Invalid file chunk"}, to=sid)
+                return
+
+        # Only bookkeeping happens under the lock; the completed transfer is
+        # claimed (popped) here and decrypted/re-broadcast after releasing it,
+        # so other transfers are not stalled behind disk I/O and emits
         with self.file_transfer_lock:
             # Initialize transfer tracking
             if transfer_id not in self.active_file_transfers:
@@ -650,147 +929,142 @@ class ChatServer:
                 transfer_info["metadata"] = metadata
                 transfer_info["total_chunks"] = metadata.get("total_chunks", 0)
                 transfer_info["iv"] = metadata.get("iv")
+                transfer_info["alg"] = metadata.get("alg")
 
             transfer_info["received_chunks"] += 1
-            transfer_info["encrypted_chunks"][chunk_index] = base64.b64decode(
-                chunk_data
-            )
+            transfer_info["encrypted_chunks"][chunk_index] = bytes(chunk_data)
 
-            # If complete, decrypt and broadcast plaintext chunks
-            if (
+            complete = (
                 transfer_info["received_chunks"] >= transfer_info["total_chunks"]
                 and transfer_info["total_chunks"] > 0
-            ):
-                try:
-                    key = self.session_keys.get(sid)
-                    if not key:
-                        self.sio.emit(
-                            "error",
-                            {"message": "Session key not found for file."},
-                            to=sid,
-                        )
-                        del self.active_file_transfers[transfer_id]
-                        return
-                    iv_b64 = transfer_info.get("iv") or ""
-                    iv = base64.b64decode(iv_b64)
-                    # Reassemble ciphertext
-                    chunks_dict = transfer_info["encrypted_chunks"]
-                    ciphertext = b"".join(
-                        chunks_dict[i] for i in sorted(chunks_dict.keys())
-                    )
-                    plaintext = ChatServer._aes_decrypt(ciphertext, key, iv)
+            )
+            if complete:
+                del self.active_file_transfers[transfer_id]
 
-                    # Cache plaintext to disk
-                    filename = transfer_info["metadata"].get("filename", "file")
-                    safe_name = os.path.basename(filename) or "file"
-                    out_path = os.path.join(
-                        self.upload_dir, f"{transfer_id}_{safe_name}"
-                    )
-                    try:
-                        with open(out_path, "wb") as f:
-                            f.write(plaintext)
-                    except OSError as e:
-                        logging.error(f"Failed to cache file: {e}")
-                        self.sio.emit(
-                            "error",
-                            {"message": f"Server failed caching file: {e}"},
-                            to=sid,
-                        )
-                        del self.active_file_transfers[transfer_id]
-                        return
-
-                    # Stream plaintext from disk in chunks
-                    chunk_size = transfer_info["metadata"].get("chunk_size", 64 * 1024)
-                    total_size = len(plaintext)
-                    total_chunks = max(1, (total_size + chunk_size - 1) // chunk_size)
-
-                    # Determine target (broadcast or specific recipient)
-                    target_sid = None
-                    if transfer_info["is_private"] and transfer_info["recipient"]:
-                        with self.lock:
-                            for client_sid, username in self.clients.items():
-                                if username == transfer_info["recipient"]:
-                                    target_sid = client_sid
-                                    break
-                        if not target_sid:
-                            self.sio.emit(
-                                "error",
-                                {
-                                    "message": f"Recipient '{transfer_info['recipient']}' not found"
-                                },
-                                to=sid,
-                            )
-                            del self.active_file_transfers[transfer_id]
-                            return
+        # If complete, decrypt and broadcast plaintext chunks
+        if complete:
+            self._deliver_file(sid, transfer_id, transfer_info, sender_username)
 
-                    server_ts = datetime.now(timezone.utc).isoformat()
+    def _deliver_file(self, sid, transfer_id, transfer_info, sender_username):
+        """Decrypt a fully received transfer and stream it to its audience."""
+        try:
+            key = self.session_keys.get(sid)
+            if not key:
+                self.sio.emit(
+                    "error",
+                    {"message": "Session key not found for file."},
+                    to=sid,
+                )
+                return
+            # Current clients send the nonce as raw bytes (binary
+            # attachment); older ones base64-encode it
+            iv = transfer_info.get("iv") or b""
+            if isinstance(iv, str):
+                iv = base64.b64decode(iv)
+            # Reassembling and decrypting a multi-MB file is the one CPU-heavy
+            # step; keep it off the hub so small events keep flowing meanwhile
+            plaintext = self._run_blocking(
+                ChatServer._decrypt_transfer,
+                transfer_info["encrypted_chunks"],
+                key,
+                iv,
+                transfer_info.get("alg"),
+            )
 
-                    # Send all chunks
-                    try:
-                        with open(out_path, "rb") as f:
-                            for chunk_idx in range(total_chunks):
-                                chunk_data = f.read(chunk_size)
-                                if not chunk_data:
-                                    break
-
-                                payload = {
-                                    "transfer_id": transfer_id,
-                                    "chunk_index": chunk_idx,
-                                    "chunk_data": base64.b64encode(chunk_data).decode(
-                                        "utf-8"
-                                    ),
-                                    "is_last_chunk": chunk_idx == total_chunks - 1,
-                                }
-
-                                # Include metadata in first chunk
-                                if chunk_idx == 0:
-                                    payload["metadata"] = {
-                                        "filename": safe_name,
-                                        "total_size": total_size,
-                                        "total_chunks": total_chunks,
-                                        "chunk_size": chunk_size,
-                                        "username": sender_username,
-                                        "timestamp": server_ts,
-                                        "is_private": bool(transfer_info["is_private"]),
-                                        "recipient": (
-                                            transfer_info["recipient"]
-                                            if transfer_info["is_private"]
-                                            else ""
-                                        ),
-                                    }
-
-                                # Emit to target or broadcast
-                                if target_sid:
-                                    self.sio.emit("file_chunk", payload, to=target_sid)
-                                else:
-                                    self.sio.emit("file_chunk", payload)
-
-                        logging.info(
-                            f"Decrypted file broadcast complete: {transfer_id} ({total_chunks} chunks)"
-                        )
-
-                    except OSError as e:
-                        logging.error(f"Failed streaming file: {e}")
-                        self.sio.emit(
-                            "error", {"message": f"Server streaming error: {e}"}, to=sid
-                        )
-                    finally:
-                        # Clean up transfer tracking and temp file
-                        if transfer_id in self.active_file_transfers:
-                            del self.active_file_transfers[transfer_id]
-                        try:
-                            os.remove(out_path)
-                        except OSError:
-                            pass
-
-                except Exception as e:
-                    logging.error(f"File decrypt/broadcast failed: {e}")
+            # Determine target (broadcast or specific recipient)
+            target_sid = None
+            if transfer_info["is_private"] and transfer_info["recipient"]:
+                target_sid = self.username_to_sid.get(transfer_info["recipient"])
+                if not target_sid:
                     self.sio.emit(
-                        "error", {"message": f"File decrypt failed: {e}"}, to=sid
+                        "error",
+                        {
+                            "message": f"Recipient '{transfer_info['recipient']}' not found"
+                        },
+                        to=sid,
                     )
-                    # Clean up on error
-                    if transfer_id in self.active_file_transfers:
-                        del self.active_file_transfers[transfer_id]
+                    return
+
+            # Cache plaintext to disk
+            filename = transfer_info["metadata"].get("filename", "file")
+            safe_name = os.path.basename(filename) or "file"
+            out_path = os.path.join(self.upload_dir, f"{transfer_id}_{safe_name}")
+            try:
+                with open(out_path, "wb") as f:
+                    f.write(plaintext)
+            except OSError as e:
+                logging.error(f"Failed to cache file: {e}")
+                self.sio.emit(
+                    "error",
+                    {"message": f"Server failed caching file: {e}"},
+                    to=sid,
+                )
+                return
+
+            # Stream plaintext from disk in chunks
+            chunk_size = transfer_info["metadata"].get("chunk_size", 64 * 1024)
+            total_size = len(plaintext)
+            total_chunks = max(1, (total_size + chunk_size - 1) // chunk_size)
+
+            server_ts = datetime.now(timezone.utc).isoformat()
+
+            # Send all chunks
+            emit = self.sio.emit  # bound once for the per-chunk loop
+            try:
+                with open(out_path, "rb") as f:
+                    for chunk_idx in range(total_chunks):
+                        chunk_data = f.read(chunk_size)
+                        if not chunk_data:
+                            break
+
+                        payload = {
+                            "transfer_id": transfer_id,
+                            "chunk_index": chunk_idx,
+                            "chunk_data": chunk_data,
+                            "is_last_chunk": chunk_idx == total_chunks - 1,
+                        }
+
+                        # Include metadata in first chunk
+                        if chunk_idx == 0:
+                            payload["metadata"] = {
+                                "filename": safe_name,
+                                "total_size": total_size,
+                                "total_chunks": total_chunks,
+                                "chunk_size": chunk_size,
+                                "username": sender_username,
+                                "timestamp": server_ts,
+                                "is_private": bool(transfer_info["is_private"]),
+                                "recipient": (
+                                    transfer_info["recipient"]
+                                    if transfer_info["is_private"]
+                                    else ""
+                                ),
+                            }
+
+                        # Emit to target, or broadcast when target_sid is None
+                        emit("file_chunk", payload, to=target_sid)
+
+                logging.info(
+                    "Decrypted file broadcast complete: %s (%d chunks)",
+                    transfer_id,
+                    total_chunks,
+                )
+
+            except OSError as e:
+                logging.error(f"Failed streaming file: {e}")
+                self.sio.emit(
+                    "error", {"message": f"Server streaming error: {e}"}, to=sid
+                )
+            finally:
+                # Clean up temp file
+                try:
+                    os.remove(out_path)
+                except OSError:
+                    pass
+
+        except Exception as e:
+            logging.error(f"File decrypt/broadcast failed: {e}")
+            self.sio.emit("error", {"message": f"File decrypt failed: {e}"}, to=sid)
 
 
 # Create server instance at module level for gunicorn
@@ -818,8 +1092,18 @@ if __name__ == "__main__":
         import eventlet
         import eventlet.wsgi
 
+        # Every open Socket.IO connection parks one green thread, so eventlet's
+        # default pool of 1024 is a hard ceiling on concurrent clients; the
+        # default listen backlog of 50 also drops bursts of new connections
+        max_connections = int(os.environ.get("CHAT_MAX_CONNECTIONS", 10000))
+        backlog = int(os.environ.get("CHAT_LISTEN_BACKLOG", 1024))
+
         logging.info("Using eventlet WSGI server (recommended for Socket.IO)")
-        eventlet.wsgi.server(eventlet.listen((HOST, PORT)), server.app)
+        eventlet.wsgi.server(
+            eventlet.listen((HOST, PORT), backlog=backlog),
+            server.app,
+            max_size=max_connections,
+        )
     except ImportError:
         try:
             from gevent import pywsgi
@@ -3,67 +3,109 @@ Professional Load Test for Chat Server with Private Messaging
 
 This script tests both public and private messaging capabilities of the chat server.
 Uses a synchronized approach to ensure proper message delivery testing.
+All clients are ``socketio.AsyncClient`` instances driven by one asyncio event
+loop, so the tester scales to many connections without a thread per client.
 """
 
-import threading
+import asyncio
+import math
 import time
 import socketio
 import statistics
 import argparse
-from typing import List, Dict
+from array import array
+from typing import Dict, Sequence
+
+try:
+    import orjson  # optional: faster Socket.IO packet (de)serialisation
+except ImportError:
+    orjson = None
 
 # Configuration
 SERVER_URL = "http://localhost:5000"
+# Emit back to back and only yield briefly every EMIT_BATCH messages, so the
+# tester is limited by the server rather than by its own pacing
+EMIT_BATCH = 50
+NS_PER_MS = 1_000_000
+
+
+# Same codec as client/client.py; kept local so the load tester does not
+# import the PySide6 client just for it
+class _OrjsonCodec:
+    """``json``-module stand-in handed to python-socketio when orjson exists."""
+
+    @staticmethod
+    def dumps(obj, **_kwargs):
+        # socketio passes stdlib-only kwargs (separators); orjson is compact
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    @staticmethod
+    def loads(data, **_kwargs):
+        return orjson.loads(data)
+
+
+def _make_sio() -> socketio.AsyncClient:
+    return socketio.AsyncClient(json=_OrjsonCodec if orjson is not None else None)
 
 
-# Metrics (thread-safe)
+# Metrics (single event loop, so no locking needed)
 class Metrics:
     def __init__(self):
-        self.lock = threading.Lock()
-        self.public_latencies: List[float] = []
-        self.private_latencies: List[float] = []
+        # Integer nanoseconds in unboxed int64 arrays; converted to ms only
+        # when the report is printed
+        self.public_latencies = array("q")
+        self.private_latencies = array("q")
         self.successful_connections = 0
         self.failed_connections = 0
         self.public_messages_sent = 0
         self.private_messages_sent = 0
-        self.private_messages_received = 0
+        self._private_target = 0
+        self._private_done = None
 
-    def add_public_latency(self, latency: float):
-        with self.lock:
-            self.public_latencies.append(latency)
+    def add_public_latency(self, latency_ns: int):
+        self.public_latencies.append(latency_ns)
 
-    def add_private_latency(self, latency: float):
-        with self.lock:
-            self.private_latencies.append(latency)
-            self.private_messages_received += 1
+    def add_private_latency(self, latency_ns: int):
+        self.private_latencies.append(latency_ns)
+        if (
+            self._private_done is not None
+            and len(self.private_latencies) >= self._private_target
+        ):
+            self._private_done.set()
 
     def increment_connection_success(self):
-        with self.lock:
-            self.successful_connections += 1
+        self.successful_connections += 1
 
     def increment_connection_failure(self):
-        with self.lock:
-            self.failed_connections += 1
+        self.failed_connections += 1
 
     def increment_public_sent(self):
-        with self.lock:
-            self.public_messages_sent += 1
+        self.public_messages_sent += 1
 
     def increment_private_sent(self):
-        with self.lock:
-            self.private_messages_sent += 1
+        self.private_messages_sent += 1
+
+    async def wait_for_private(self, count: int, timeout: float) -> bool:
+        """Wait until ``count`` private messages have arrived, without polling"""
+        if len(self.private_latencies) < count:
+            self._private_target = count
+            self._private_done = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._private_done.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
 
     def get_stats(self) -> Dict:
-        with self.lock:
-            return {
-                "public_latencies": self.public_latencies.copy(),
-                "private_latencies": self.private_latencies.copy(),
-                "successful_connections": self.successful_connections,
-                "failed_connections": self.failed_connections,
-                "public_messages_sent": self.public_messages_sent,
-                "private_messages_sent": self.private_messages_sent,
-                "private_messages_received": self.private_messages_received,
-            }
+        return {
+            "public_latencies": array("q", self.public_latencies),
+            "private_latencies": array("q", self.private_latencies),
+            "successful_connections": self.successful_connections,
+            "failed_connections": self.failed_connections,
+            "public_messages_sent": self.public_messages_sent,
+            "private_messages_sent": self.private_messages_sent,
+            "private_messages_received": len(self.private_latencies),
+        }
 
 
 # Global metrics instance
@@ -77,148 +119,143 @@ class TestClient:
         self.client_id = client_id
         self.num_clients = num_clients
         self.username = f"test_user_{client_id}"
-        self.sio = socketio.Client()
+        self.registered = asyncio.Event()
+        self.sio = _make_sio()
         self._setup_handlers()
 
     def _setup_handlers(self):
         """Set up Socket.IO event handlers"""
 
+        @self.sio.on("update_user_list")
+        async def on_user_list(data):
+            if self.username in data.get("users", []):
+                self.registered.set()
+
         @self.sio.on("private_message_received")
-        def on_private_message(data):
-            if "timestamp" in data:
-                latency = time.time() - data["timestamp"]
-                metrics.add_private_latency(latency)
+        async def on_private_message(data):
+            sent_at = data.get("timestamp")
+            if isinstance(sent_at, int):
+                metrics.add_private_latency(time.monotonic_ns() - sent_at)
 
-    def connect(self) -> bool:
+    async def connect(self) -> bool:
         """Connect to server and register"""
         try:
-            self.sio.connect(SERVER_URL)
-            self.sio.emit("register", {"username": self.username})
+            await self.sio.connect(SERVER_URL)
+            await self.sio.emit("register", {"username": self.username})
+            # Without send pacing, peers can start messaging before the server
+            # has processed this registration; hold the phase until it has
+            await asyncio.wait_for(self.registered.wait(), timeout=5)
             metrics.increment_connection_success()
             return True
         except Exception:
             metrics.increment_connection_failure()
             return False
 
-    def send_public_messages(self, count: int):
+    async def send_public_messages(self, count: int):
         """Send public messages"""
+        # One payload dict reused for every emit; AsyncClient encodes the
+        # packet before emit() yields, so mutating it afterwards is safe
+        payload = {"message": "", "timestamp": 0}
+        suffix = f" from {self.username}"
         for i in range(count):
-            payload = {
-                "message": f"Public message {i} from {self.username}",
-                "timestamp": time.time(),
-            }
-            self.sio.emit("message", payload)
+            payload["message"] = f"Public message {i}{suffix}"
+            payload["timestamp"] = time.monotonic_ns()
+            await self.sio.emit("message", payload)
             metrics.increment_public_sent()
-            time.sleep(0.01)  # Small delay to prevent overwhelming
+            if (i + 1) % EMIT_BATCH == 0:
+                await asyncio.sleep(0.001)
 
-    def send_private_messages(self, count: int):
+    async def send_private_messages(self, count: int):
         """Send private messages to other clients"""
+        if self.num_clients <= 1:
+            return
+
+        # Round-robin over the other clients' names, built once
+        targets = [
+            f"test_user_{target_id}"
+            for target_id in range(self.num_clients)
+            if target_id != self.client_id
+        ]
+        offset = self.client_id  # so each client starts with its next peer
+        payload = {"recipient": "", "message": "", "timestamp": 0}
+        suffix = f" from {self.username}"
         for i in range(count):
-            if self.num_clients <= 1:
-                continue
-
-            # Target different clients in round-robin fashion
-            target_id = (self.client_id + 1 + i) % self.num_clients
-            if target_id == self.client_id:  # Skip self
-                target_id = (target_id + 1) % self.num_clients
-
-            payload = {
-                "recipient": f"test_user_{target_id}",
-                "message": f"Private message {i} from {self.username}",
-                "timestamp": time.time(),
-            }
-            self.sio.emit("private_message", payload)
+            payload["recipient"] = targets[(offset + i) % len(targets)]
+            payload["message"] = f"Private message {i}{suffix}"
+            payload["timestamp"] = time.monotonic_ns()
+            await self.sio.emit("private_message", payload)
             metrics.increment_private_sent()
-            time.sleep(0.01)
+            if (i + 1) % EMIT_BATCH == 0:
+                await asyncio.sleep(0.001)
 
-    def disconnect(self):
+    async def disconnect(self):
         """Disconnect from server"""
         try:
-            self.sio.disconnect()
+            await self.sio.disconnect()
         except Exception:
             pass
 
 
-def run_client_test(
-    client_id: int,
-    num_clients: int,
-    public_count: int,
-    private_count: int,
-    connect_barrier: threading.Barrier,
-    private_phase_barrier: threading.Barrier,
-):
-    """Run a complete test cycle for one client"""
-
-    client = TestClient(client_id, num_clients)
-
-    # Connect to server
-    if not client.connect():
-        # If connection fails, we must still participate in the barrier to not deadlock others
-        try:
-            connect_barrier.wait(timeout=5)
-            private_phase_barrier.wait(timeout=5)
-        except threading.BrokenBarrierError:
-            pass  # Other threads may have aborted
-        return
-
-    # Wait for all clients to be connected and registered
-    try:
-        connect_barrier.wait(timeout=10 + num_clients * 0.1)
-    except threading.BrokenBarrierError:
-        print(f"Client {client_id} failed to sync at connect barrier.")
-        client.disconnect()
-        return
-
-    # Phase 1: Send public messages
-    client.send_public_messages(public_count)
-
-    # Wait for all clients to finish the public phase
-    try:
-        private_phase_barrier.wait(timeout=10 + public_count * 0.1)
-    except threading.BrokenBarrierError:
-        print(f"Client {client_id} failed to sync at private phase barrier.")
-        client.disconnect()
-        return
-
-    # Phase 2: Send private messages
-    client.send_private_messages(private_count)
-
-    # Client remains connected to receive messages. The main thread will handle shutdown.
-    # The disconnect will be called from the main thread after the wait period.
-    # This ensures the client is available to receive all in-flight messages.
-
-
 class MessageListener:
     """Dedicated listener for public messages"""
 
     def __init__(self):
-        self.sio = socketio.Client()
+        self.sio = _make_sio()
         self._setup_handlers()
 
     def _setup_handlers(self):
         @self.sio.on("message")
-        def on_message(data):
-            if "timestamp" in data:
-                latency = time.time() - data["timestamp"]
-                metrics.add_public_latency(latency)
+        async def on_message(data):
+            # System notices (e.g. "x has left") carry ISO string timestamps
+            sent_at = data.get("timestamp")
+            if isinstance(sent_at, int):
+                metrics.add_public_latency(time.monotonic_ns() - sent_at)
 
-    def start(self):
+    async def start(self):
         """Start listening"""
         try:
-            self.sio.connect(SERVER_URL)
-            self.sio.emit("register", {"username": "message_listener"})
+            await self.sio.connect(SERVER_URL)
+            await self.sio.emit("register", {"username": "message_listener"})
             return True
         except Exception:
             return False
 
-    def stop(self):
+    async def stop(self):
         """Stop listening"""
         try:
-            self.sio.disconnect()
+            await self.sio.disconnect()
         except Exception:
             pass
 
 
+def summarize_latencies(latencies: Sequence[int]) -> Dict[str, float]:
+    """Avg/min/max and p50/p95/p99 in milliseconds from one sorted copy of ns"""
+    ordered = sorted(latencies)
+    n = len(ordered)
+
+    def pct(p: float) -> float:
+        # Nearest-rank percentile
+        return ordered[max(0, math.ceil(p / 100 * n) - 1)] / NS_PER_MS
+
+    return {
+        "avg": statistics.fmean(ordered) / NS_PER_MS,
+        "min": ordered[0] / NS_PER_MS,
+        "max": ordered[-1] / NS_PER_MS,
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+    }
+
+
+def print_latency_summary(summary: Dict[str, float]):
+    print(
+        f"Latency - Avg: {summary['avg']:.2f}ms, Min: {summary['min']:.2f}ms, Max: {summary['max']:.2f}ms"
+    )
+    print(
+        f"Percentiles - p50: {summary['p50']:.2f}ms, p95: {summary['p95']:.2f}ms, p99: {summary['p99']:.2f}ms"
+    )
+
+
 def print_results(
     duration: float, num_clients: int, public_per_client: int, private_per_client: int
 ):
@@ -241,9 +278,7 @@ def print_results(
     print(f"Received: {len(stats['public_latencies'])}")
 
     if stats["public_latencies"]:
-        avg_latency = statistics.mean(stats['public_latencies']) * 1000
-        min_latency = min(stats['public_latencies']) * 1000
-        max_latency = max(stats['public_latencies']) * 1000
+        summary = summarize_latencies(stats["public_latencies"])
         
         # Calculate throughput based on the time the public phase was active
         public_throughput_duration = duration  # Simplified for now
@@ -251,9 +286,7 @@ def print_results(
             throughput = len(stats['public_latencies']) / public_throughput_duration
             print(f"Throughput: {throughput:.2f} messages/sec")
 
-        print(
-            f"Latency - Avg: {avg_latency:.2f}ms, Min: {min_latency:.2f}ms, Max: {max_latency:.2f}ms"
-        )
+        print_latency_summary(summary)
         
 
     # Private Messages
@@ -262,9 +295,7 @@ def print_results(
     print(f"Received: {stats['private_messages_received']}")
 
     if stats["private_latencies"]:
-        avg_latency = statistics.mean(stats['private_latencies']) * 1000
-        min_latency = min(stats['private_latencies']) * 1000
-        max_latency = max(stats['private_latencies']) * 1000
+        summary = summarize_latencies(stats["private_latencies"])
         
         # Calculate throughput based on the time the private phase was active
         private_throughput_duration = duration # Simplified for now
@@ -272,9 +303,7 @@ def print_results(
             throughput = len(stats['private_latencies']) / private_throughput_duration
             print(f"Throughput: {throughput:.2f} messages/sec")
 
-        print(
-            f"Latency - Avg: {avg_latency:.2f}ms, Min: {min_latency:.2f}ms, Max: {max_latency:.2f}ms"
-        )
+        print_latency_summary(summary)
         
 
         # Delivery rate
@@ -295,8 +324,10 @@ def print_results(
     print(f"Overall Throughput: {overall_throughput:.2f} messages/sec")
 
 
-def main(num_clients: int, public_messages: int, private_messages: int):
-    """Main test execution"""
+async def run_load_test(
+    num_clients: int, public_messages: int, private_messages: int
+):
+    """Drive every client from this event loop, one phase at a time"""
 
     print(f"Starting Load Test:")
     print(f"  - {num_clients} clients")
@@ -306,68 +337,46 @@ def main(num_clients: int, public_messages: int, private_messages: int):
 
     start_time = time.time()
 
-    # Barriers for synchronization. Number of parties is all client threads.
-    connect_barrier = threading.Barrier(num_clients)
-    private_phase_barrier = threading.Barrier(num_clients)
-
     # Start message listener
     listener = MessageListener()
-    if not listener.start():
+    if not await listener.start():
         print("Failed to start message listener!")
         return
 
-    # Start client threads
-    threads = []
-    clients = []  # Keep a reference to client objects for disconnection
-    for i in range(num_clients):
-        # Create client object and pass to thread
-        client_obj = TestClient(i, num_clients)
-        clients.append(client_obj)
-        
-        thread = threading.Thread(
-            target=run_client_test,
-            args=(
-                i,
-                num_clients,
-                public_messages,
-                private_messages,
-                connect_barrier,
-                private_phase_barrier,
-            ),
-            daemon=True,
-        )
-        threads.append(thread)
-        thread.start()
-        time.sleep(0.01)  # Stagger connection attempts slightly
+    clients = [TestClient(i, num_clients) for i in range(num_clients)]
+
+    # Phase 0: connect and register everyone; gathering the phase replaces the
+    # thread barriers, so no client starts sending before all are registered
+    connected = await asyncio.gather(*(client.connect() for client in clients))
+    active = [client for client, ok in zip(clients, connected) if ok]
+
+    # Phase 1: Send public messages
+    await asyncio.gather(
+        *(client.send_public_messages(public_messages) for client in active)
+    )
+
+    # Phase 2: Send private messages
+    await asyncio.gather(
+        *(client.send_private_messages(private_messages) for client in active)
+    )
 
-    # Wait for all threads to finish their work
     # A global timeout to prevent the test from hanging indefinitely
     global_timeout = 20 + num_clients * (public_messages + private_messages) * 0.1
-    
-    total_private_sent = num_clients * private_messages
-    wait_start_time = time.time()
+
+    total_private_sent = metrics.private_messages_sent
 
     print("All clients running. Waiting for private messages to be delivered...")
-    
-    # Wait until all expected private messages are received or timeout
-    while (
-        metrics.get_stats()["private_messages_received"] < total_private_sent
-        and time.time() - wait_start_time < global_timeout
-    ):
-        time.sleep(0.1)
 
-    if metrics.get_stats()["private_messages_received"] < total_private_sent:
+    # Wait until all expected private messages are received or timeout
+    if not await metrics.wait_for_private(total_private_sent, global_timeout):
         print(f"\nWarning: Test timed out after {global_timeout:.1f}s. Not all private messages were received.")
 
     # Gracefully disconnect all clients
     print("Test finished. Disconnecting clients...")
-    for thread in threads:
-        if thread.is_alive():
-            # The threads are waiting, but we can now disconnect their client objects
-            pass # Threads will exit as they are daemons
+    await asyncio.gather(*(client.disconnect() for client in clients))
 
     # Stop listener
-    listener.stop()
+    await listener.stop()
 
     end_time = time.time()
     duration = end_time - start_time
@@ -376,6 +385,11 @@ def main(num_clients: int, public_messages: int, private_messages: int):
     print_results(duration, num_clients, public_messages, private_messages)
 
 
+def main(num_clients: int, public_messages: int, private_messages: int):
+    """Main test execution"""
+    asyncio.run(run_load_test(num_clients, public_messages, private_messages))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Professional Chat Server Load Tester")
     parser.add_argument(
@@ -1,14 +1,17 @@
+import base64
 import os
 import sys
+import threading
+from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Tuple
 
 # Ensure the project root is on the path so we can import the client package
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import pytest
-from PySide6.QtCore import QCoreApplication
+from PySide6.QtCore import QCoreApplication, QThreadPool, QUrl
 
-from client.client import ChatClient
+from client.client import CONN_IDLE, ChatClient
 
 
 class FakeSocketIOClient:
@@ -64,7 +67,7 @@ def chat_client(
     monkeypatch: pytest.MonkeyPatch,
 ) -> Tuple[ChatClient, FakeSocketIOClient]:
     fake_client = FakeSocketIOClient()
-    monkeypatch.setattr("client.client.socketio.Client", lambda: fake_client)
+    monkeypatch.setattr("client.client.socketio.Client", lambda *args, **kwargs: fake_client)
 
     chat = ChatClient("http://localhost:5001")
     # Avoid background threads in the tests; connect synchronously against the fake client.
@@ -108,6 +111,62 @@ def test_error_event_emits_signal_and_resets_desired_username(
     assert chat._desired_username == ""  # type: ignore[attr-defined]
 
 
+def test_register_rejects_name_already_in_roster(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+) -> None:
+    chat, fake = chat_client
+    errors: List[str] = []
+    chat.errorReceived.connect(errors.append)
+    fake.handlers["update_user_list"]({"users": ["Alice"]})
+
+    chat.register("alice")
+
+    assert errors[-1] == "Username 'alice' is already taken."
+    assert ("register", {"username": "alice"}) not in fake.emitted
+    assert chat._desired_username == ""  # type: ignore[attr-defined]
+
+
+def test_register_rejects_width_and_casefold_variants(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+) -> None:
+    chat, fake = chat_client
+    errors: List[str] = []
+    chat.errorReceived.connect(errors.append)
+    fake.handlers["update_user_list"]({"users": ["alice", "Stra\u00dfe"]})
+
+    for variant in ("\uff21\uff2c\uff29\uff23\uff25", "STRASSE"):
+        chat.register(variant)
+        assert errors[-1] == f"Username '{variant}' is already taken."
+        assert ("register", {"username": variant}) not in fake.emitted
+
+
+def test_exhausted_reconnect_attempts_reset_connection_state(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    chat, fake = chat_client
+    monkeypatch.setattr("client.client.MAX_RECONNECT_ATTEMPTS", 2)
+    errors: List[str] = []
+    chat.errorReceived.connect(errors.append)
+    fake.reconnection = True  # type: ignore[attr-defined]
+
+    chat.register("erin")
+    fake.handlers["disconnect"]()
+    assert chat._reconnecting  # type: ignore[attr-defined]
+
+    # Older python-socketio stops retrying without "__disconnect_final"
+    fake.handlers["connect_error"]()
+    fake.handlers["connect_error"]()
+
+    assert not chat._reconnecting  # type: ignore[attr-defined]
+    assert chat._conn_state == CONN_IDLE  # type: ignore[attr-defined]
+    assert errors[-1] == "Failed to reconnect after 2 attempts."
+
+    # A later final event from newer versions must not notify twice
+    fake.handlers["__disconnect_final"]()
+    assert errors.count("Failed to reconnect after 2 attempts.") == 1
+
+
 def test_send_message_rejects_empty_payload(
     chat_client: Tuple[ChatClient, FakeSocketIOClient],
 ) -> None:
@@ -148,3 +207,201 @@ def test_send_private_message_requires_body(
 
     assert fake.emitted == []
     assert errors[-1] == "Cannot send an empty private message."
+
+
+@pytest.mark.parametrize(
+    "file_url, expected",
+    [
+        ("file:///tmp/a%20b.txt", "/tmp/a b.txt"),
+        ("file:/home/x.txt", "/home/x.txt"),
+        ("file:///tmp/a?x=1", "/tmp/a"),
+        ("file:///tmp/a#frag", "/tmp/a"),
+        ("/tmp/plain.txt", "/tmp/plain.txt"),
+    ],
+)
+def test_normalize_file_path_matches_qurl(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+    file_url: str,
+    expected: str,
+) -> None:
+    chat, _ = chat_client
+    assert chat._normalize_file_path(file_url) == Path(expected)  # type: ignore[attr-defined]
+
+
+def test_prepare_file_payload_streams_base64_round_trip(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+    tmp_path,
+) -> None:
+    chat, _ = chat_client
+    raw = os.urandom(3 * 64 * 1024 * 2 + 7)  # spans several encode chunks
+    source = tmp_path / "blob.bin"
+    source.write_bytes(raw)
+
+    payload = chat._prepare_file_payload(source)  # type: ignore[attr-defined]
+
+    assert payload is not None
+    assert payload["data"] == base64.b64encode(raw).decode("ascii")
+    assert payload["size"] == len(raw)
+
+    saved_url = chat.saveFileToTemp("blob.bin", payload["data"], payload["mime"])
+    saved = Path(QUrl(saved_url).toLocalFile())
+    try:
+        assert saved.read_bytes() == raw
+    finally:
+        saved.unlink()
+
+
+def test_prepare_file_payload_tolerates_short_reads(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path,
+) -> None:
+    chat, _ = chat_client
+    raw = os.urandom(3 * 64 * 1024 + 11)
+    source = tmp_path / "slow.bin"
+    source.write_bytes(raw)
+
+    class ShortReader:
+        """Raw file that, like a network mount, returns 1000 bytes per read."""
+
+        def __init__(self, path, *args, **kwargs) -> None:
+            self._f = open(path, "rb", buffering=0)
+
+        def readinto(self, buf) -> int:
+            return self._f.readinto(memoryview(buf)[:1000])
+
+        def __enter__(self) -> "ShortReader":
+            return self
+
+        def __exit__(self, *exc) -> None:
+            self._f.close()
+
+    monkeypatch.setattr("client.client.open", ShortReader, raising=False)
+
+    payload = chat._prepare_file_payload(source)  # type: ignore[attr-defined]
+
+    assert payload is not None
+    assert payload["data"] == base64.b64encode(raw).decode("ascii")
+
+
+def test_history_file_is_requested_and_saved_on_arrival(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    chat, fake = chat_client
+    saved_calls: List[Tuple[str, str, str]] = []
+    monkeypatch.setattr(
+        chat,
+        "saveFileToDownloads",
+        lambda name, data, mime: saved_calls.append((name, data, mime)) or "file:///x",
+    )
+    results: List[Tuple[str, str]] = []
+    chat.historyFileSaved.connect(lambda name, url: results.append((name, url)))
+
+    chat.requestHistoryFile("abc123", "notes.txt", "text/plain")
+    assert ("request_file", {"file_id": "abc123"}) in fake.emitted
+
+    fake.handlers["history_file"]({"file_id": "unknown", "data": "QUFB"})
+    fake.handlers["history_file"]({"file_id": "abc123", "data": "QUFB"})
+    fake.handlers["history_file"]({"file_id": "abc123", "data": "QUFB"})
+
+    assert saved_calls == [("notes.txt", "QUFB", "text/plain")]
+    assert results == [("notes.txt", "file:///x")]
+
+
+def test_inspect_file_reports_result_asynchronously(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+    tmp_path,
+) -> None:
+    chat, _ = chat_client
+    source = tmp_path / "notes.txt"
+    source.write_text("hello")
+    inspected: List[Tuple[str, Dict[str, Any]]] = []
+    chat.fileInspected.connect(lambda job_id, info: inspected.append((job_id, info)))
+
+    job_id = chat.inspectFile(QUrl.fromLocalFile(str(source)).toString())
+
+    assert job_id
+    QThreadPool.globalInstance().waitForDone()
+    QCoreApplication.processEvents()
+
+    assert inspected and inspected[0][0] == job_id
+    assert inspected[0][1]["name"] == "notes.txt"
+    assert inspected[0][1]["size"] == 5
+
+
+def test_typing_and_read_receipts_are_coalesced_until_flush(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+) -> None:
+    chat, fake = chat_client
+    chat.register("carol")
+    fake.emitted.clear()
+
+    chat.indicatePublicTyping(True)
+    chat.indicatePublicTyping(False)
+    chat.markPrivateMessagesRead("dave", [3, 1])
+    chat.markPrivateMessagesRead("dave", [1, 2])
+
+    assert fake.emitted == []
+
+    chat._flush_pending()  # type: ignore[attr-defined]
+
+    assert fake.emitted == [
+        ("typing", {"context": "public", "is_typing": False}),
+        ("private_message_read", {"recipient": "dave", "message_ids": [1, 2, 3]}),
+    ]
+
+
+def test_user_list_from_socket_thread_is_applied_on_qt_thread(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+) -> None:
+    chat, fake = chat_client
+    chat.register("erin")
+    updates: List[List[str]] = []
+    chat.usersUpdated.connect(updates.append)
+
+    worker = threading.Thread(
+        target=fake.handlers["update_user_list"], args=({"users": ["erin", "finn"]},)
+    )
+    worker.start()
+    worker.join()
+
+    assert chat.username == ""
+    QCoreApplication.processEvents()
+
+    assert chat.username == "erin"
+    assert updates[-1] == ["erin", "finn"]
+
+
+def test_file_chunks_are_reassembled_in_place_out_of_order(
+    chat_client: Tuple[ChatClient, FakeSocketIOClient],
+) -> None:
+    chat, fake = chat_client
+    received: List[Dict[str, Any]] = []
+    chat.messageReceivedEx.connect(lambda user, text, file, ts: received.append(file))
+    payload = bytes(range(256)) * 10
+    meta = {
+        "filename": "blob.bin",
+        "total_size": len(payload),
+        "total_chunks": 3,
+        "chunk_size": 1024,
+    }
+    on_chunk = fake.handlers["file_chunk"]
+
+    on_chunk({"transfer_id": "t1", "chunk_index": 2, "chunk_data": payload[2048:]})
+    on_chunk(
+        {
+            "transfer_id": "t1",
+            "chunk_index": 0,
+            "chunk_data": payload[:1024],
+            "metadata": meta,
+        }
+    )
+    on_chunk({"transfer_id": "t1", "chunk_index": 1, "chunk_data": payload[1024:2048]})
+
+    for thread in list(chat._download_threads.values()):  # type: ignore[attr-defined]
+        thread.join(timeout=5)
+    QCoreApplication.processEvents()
+
+    assert received and received[0]["name"] == "blob.bin"
+    assert base64.b64decode(received[0]["data"]) == payload
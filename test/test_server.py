@@ -7,9 +7,10 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 import unittest
 import threading
 import time
+from unittest import mock
 import socketio
 import eventlet
-from server.server import ChatServer
+from server.server import ChatServer, PRIVATE_MESSAGE_RING
 
 
 class TestChatServer(unittest.TestCase):
@@ -177,6 +178,151 @@ class TestChatServer(unittest.TestCase):
         self.assertIn("staying_user", final_list_events[-1][0]["users"])
         self.assertNotIn("leaving_user", final_list_events[-1][0]["users"])
 
+    def test_06_username_reusable_after_disconnect(self):
+        """Test that a name is freed (case-insensitively) once its owner leaves."""
+        temp_client = socketio.Client()
+        temp_client.connect("http://localhost:5001")
+        temp_client.emit("register", {"username": "Recycled"})
+        time.sleep(0.1)
+        temp_client.disconnect()
+        time.sleep(0.1)
+
+        self.received_events.pop("update_user_list", None)
+        self.sio_client.emit("register", {"username": "recycled"})
+        user_list_events = self.wait_for_event("update_user_list")
+        self.assertIsNotNone(user_list_events, "Name was not released on disconnect.")
+        self.assertIn("recycled", user_list_events[-1][0]["users"])
+        self.assertNotIn("error", self.received_events)
+
+    def test_07_read_receipt_reaches_sender(self):
+        """Test that marking a private message read notifies its sender."""
+        recipient = socketio.Client()
+        received = threading.Event()
+        message_ids = []
+
+        @recipient.on("private_message_received")
+        def on_private(data):
+            message_ids.append(data["message_id"])
+            received.set()
+
+        recipient.connect("http://localhost:5001")
+        recipient.emit("register", {"username": "reader"})
+        self.sio_client.emit("register", {"username": "writer"})
+        time.sleep(0.1)
+
+        self.sio_client.emit("private_message", {"recipient": "reader", "message": "hi"})
+        self.assertTrue(received.wait(timeout=1.0), "Private message not delivered.")
+
+        # A stale id sharing the same ring slot must be ignored
+        stale_id = message_ids[0] - PRIVATE_MESSAGE_RING
+        recipient.emit("private_message_read", {"message_ids": [stale_id]})
+        recipient.emit("private_message_read", {"message_ids": message_ids})
+        read_events = self.wait_for_event("private_message_read")
+        self.assertIsNotNone(read_events, "Sender was not told the message was read.")
+        time.sleep(0.1)
+        acked = [
+            args[0]["message_id"]
+            for args in self.received_events["private_message_read"]
+        ]
+        self.assertEqual(acked, message_ids)
+
+        recipient.disconnect()
+
+    def test_08_typing_bursts_are_coalesced(self):
+        """Test that rapid typing toggles reach peers as one latest-state event."""
+        peer = socketio.Client()
+        typing_events = []
+
+        @peer.on("public_typing")
+        def on_typing(data):
+            typing_events.append(data)
+
+        peer.connect("http://localhost:5001")
+        peer.emit("register", {"username": "watcher"})
+        self.sio_client.emit("register", {"username": "typist"})
+        time.sleep(0.1)
+
+        for is_typing in (True, False, True):
+            self.sio_client.emit("typing", {"context": "public", "is_typing": is_typing})
+        time.sleep(0.3)
+
+        self.assertEqual(typing_events, [{"username": "typist", "is_typing": True}])
+        self.assertNotIn("public_typing", self.received_events)
+
+        peer.disconnect()
+
+    def test_09_read_receipts_batched_per_sender(self):
+        """Test that several receipts for one sender arrive as a single event."""
+        recipient = socketio.Client()
+        message_ids = []
+
+        @recipient.on("private_message_received")
+        def on_private(data):
+            message_ids.append(data["message_id"])
+
+        recipient.connect("http://localhost:5001")
+        recipient.emit("register", {"username": "skimmer"})
+        self.sio_client.emit("register", {"username": "chatty"})
+        time.sleep(0.1)
+
+        for text in ("one", "two", "three"):
+            self.sio_client.emit(
+                "private_message", {"recipient": "skimmer", "message": text}
+            )
+        time.sleep(0.2)
+        self.assertEqual(len(message_ids), 3)
+
+        recipient.emit("private_message_read", {"message_ids": message_ids})
+        batch_events = self.wait_for_event("private_message_read_batch")
+        self.assertIsNotNone(batch_events, "Batched read receipt not received.")
+        time.sleep(0.1)
+        self.assertEqual(batch_events, [({"message_ids": message_ids},)])
+        self.assertNotIn("private_message_read", self.received_events)
+
+        recipient.disconnect()
+
+    def test_10_username_collision_ignores_case_and_width(self):
+        """Test that case and full-width variants of a taken name are rejected."""
+        client1 = socketio.Client()
+        client1.connect("http://localhost:5001")
+        client1.emit("register", {"username": "wide"})
+        time.sleep(0.1)
+
+        self.sio_client.emit("register", {"username": "\uff37\uff29\uff24\uff25"})
+        error_events = self.wait_for_event("error")
+        self.assertIsNotNone(error_events, "Variant of a taken name was accepted.")
+        self.assertIn("already taken", error_events[0][0]["message"])
+
+        client1.disconnect()
+
+    def test_11_spilled_history_files_can_be_fetched(self):
+        """Test that history bodies over budget are spilled and still fetchable."""
+        bodies = ["QUFB" * 50, "QkJC" * 50]
+        self.sio_client.emit("register", {"username": "archivist"})
+        time.sleep(0.1)
+        with mock.patch("server.server.HISTORY_FILE_BUDGET", 300):
+            for i, body in enumerate(bodies):
+                self.sio_client.emit(
+                    "message", {"file": {"name": f"f{i}.bin", "size": 150, "data": body}}
+                )
+            time.sleep(0.2)
+
+        self.received_events.clear()
+        self.sio_client.emit("request_history")
+        history_events = self.wait_for_event("chat_history")
+        self.assertIsNotNone(history_events, "Did not receive chat history.")
+        files = [m["file"] for m in history_events[0][0]["messages"] if "file" in m]
+        spilled, kept = files[-2], files[-1]
+        self.assertNotIn("data", spilled)
+        self.assertEqual(kept["data"], bodies[1])
+
+        self.sio_client.emit("request_file", {"file_id": spilled["file_id"]})
+        file_events = self.wait_for_event("history_file")
+        self.assertIsNotNone(file_events, "Spilled file body was not returned.")
+        self.assertEqual(
+            file_events[0][0], {"file_id": spilled["file_id"], "data": bodies[0]}
+        )
+
 
 if __name__ == "__main__":
     unittest.main()